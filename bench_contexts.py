@@ -0,0 +1,94 @@
+"""
+Measures how many irc messages per second get_contexts can turn into contexts.
+
+Usage:
+    python bench_contexts.py <capture>
+    python bench_contexts.py --record <capture> <channel> [channel ...]
+
+The capture contains raw irc lines as received from twitch, one per line.
+--record makes one by joining the given channels anonymously and writing
+everything received until RECORD_LINES lines are saved or it's interrupted.
+"""
+
+import sys
+import asyncio
+import websockets
+from time import perf_counter
+
+from bot.bot import BaseBot
+from bot.context import get_contexts, ContextType
+
+
+RECORD_LINES = 50000
+
+
+def load_lines(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.rstrip("\r\n") for line in f if line.strip() != ""]
+
+
+async def record(path, channels):
+    n = 0
+    async with websockets.connect(BaseBot.IRC_URI) as ws:
+        # twitch lets anyone read chat with a justinfan nick
+        await ws.send("NICK justinfan12345")
+        await ws.send("CAP REQ :twitch.tv/tags twitch.tv/commands")
+        for channel in channels:
+            await ws.send(f"JOIN #{channel.lower()}")
+
+        with open(path, "w", encoding="utf-8", newline="\n") as f:
+            while n < RECORD_LINES:
+                data = await ws.recv()
+                if data.startswith("PING"):
+                    await ws.send("PONG :tmi.twitch.tv")
+                    continue
+
+                for line in data.split("\r\n"):
+                    if line != "":
+                        f.write(line + "\n")
+                        n += 1
+
+    return n
+
+
+def run(lines, rounds):
+    n = 0
+    start = perf_counter()
+    for _ in range(rounds):
+        for line in lines:
+            for ctx in get_contexts(line):
+                n += 1
+                # roughly what the handlers read from every message
+                if ctx.type == ContextType.PRIVMSG:
+                    ctx.room_id
+                    ctx.user_id
+                    ctx.reply
+                    ctx.message
+    return n / (perf_counter() - start)
+
+
+def main():
+    if len(sys.argv) >= 4 and sys.argv[1] == "--record":
+        try:
+            asyncio.run(record(sys.argv[2], sys.argv[3:]))
+        except KeyboardInterrupt:
+            pass
+        print(f"Recorded {len(load_lines(sys.argv[2]))} lines to {sys.argv[2]}")
+        return
+
+    if len(sys.argv) != 2:
+        print(__doc__.strip())
+        sys.exit(1)
+
+    lines = load_lines(sys.argv[1])
+    if len(lines) == 0:
+        print(f"No lines in {sys.argv[1]}")
+        sys.exit(1)
+
+    rounds = max(1, 200000 // len(lines))
+    run(lines, max(1, rounds // 10))  # warmup
+    print(f"{run(lines, rounds):.0f} messages/sec over {len(lines)} lines")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,14 @@ from .database import Database
 from .context import *
 from .util import *
 from .twitch_api import TwitchAPIHelper
+from .http_client import HTTPClient
 from .server import MessageServer
+from .context_queue import ShardedContextQueue
+from .irc import IRCPool
+from .outbound import MessageScheduler, MessagePriority
+from .eventsub import EventSubClient
+from .metrics import Metrics, MetricsServer
 
-import websockets
 import os
 import asyncio
 import sys
@@ -16,14 +21,19 @@ log = logging.getLogger(__name__)
 class BaseBot:
     __slots__ = (
         "db",
-        "ws",
+        "irc",
         "running",
         "loop",
         "last_message",
-        "message_locks",
+        "outbound",
+        "timers",
+        "watchdog",
+        "metrics",
         "own_state",
         "manager",
-        "twitch_client"
+        "http",
+        "twitch_client",
+        "eventsub"
     )
 
     TWITCH_CLIENT_ID = os.getenv("CLIENT_ID")
@@ -31,6 +41,12 @@ class BaseBot:
     IRC_USERNAME = os.getenv("IRC_USERNAME")
     IRC_OAUTH = os.getenv("IRC_OAUTH")
     IRC_URI = "wss://irc-ws.chat.twitch.tv:443"
+    IRC_CONNECTIONS = int(os.getenv("IRC_CONNECTIONS") or 3)
+    COALESCE_MESSAGES = os.getenv("COALESCE_MESSAGES", "").lower() in ("1", "true")
+    # user token for eventsub, stream statuses are polled instead if there isn't one
+    EVENTSUB_TOKEN = os.getenv("EVENTSUB_TOKEN")
+    # seconds the event loop can be blocked for before it's logged
+    LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD") or 0.25)
 
     if IRC_USERNAME is None or IRC_OAUTH is None:
         raise RuntimeError("irc username or password could not be loaded from environment variables")
@@ -42,31 +58,59 @@ class BaseBot:
     def __init__(self, loop: asyncio.AbstractEventLoop, manager: "BotManager"):
         self.db = Database()
 
-        self.ws = None
         self.running: asyncio.Event = asyncio.Event()
         self.loop: asyncio.AbstractEventLoop = loop
         self.last_message = {}
-        self.message_locks = {}
-        self.own_state = None
+        # channel -> our user state in that channel
+        self.own_state: dict[str, UserStateContext] = {}
         self.manager = manager
-
-        self.twitch_client: TwitchAPIHelper = TwitchAPIHelper(os.getenv("CLIENT_ID"), os.getenv("CLIENT_SECRET"))
+        self.timers: TimerWheel = TimerWheel(loop)
+        self.watchdog: LoopWatchdog = LoopWatchdog(self.LOOP_LAG_THRESHOLD)
+        self.metrics: Metrics = Metrics()
+
+        self.irc: IRCPool = IRCPool(
+            manager,
+            self.running,
+            self.IRC_URI,
+            self.IRC_USERNAME,
+            self.IRC_OAUTH,
+            self.IRC_CONNECTIONS
+        )
+        self.outbound: MessageScheduler = MessageScheduler(
+            self.irc.send,
+            self.is_mod_in,
+            self.last_message,
+            self.COALESCE_MESSAGES
+        )
+
+        # shared by everything that makes http requests
+        self.http: HTTPClient = HTTPClient()
+        self.twitch_client: TwitchAPIHelper = TwitchAPIHelper(
+            os.getenv("CLIENT_ID"),
+            os.getenv("CLIENT_SECRET"),
+            self.http
+        )
+        self.eventsub: EventSubClient | None = None if not self.EVENTSUB_TOKEN else EventSubClient(
+            manager,
+            self.running,
+            self.twitch_client,
+            self.EVENTSUB_TOKEN
+        )
 
     # Fundamental
 
     async def run(self) -> None:
-        try:
-            async with websockets.connect(self.IRC_URI) as ws:
-                self.ws = ws
-
-                await self.connect()
+        loops = [
+            self.loop.create_task(self.timers.run(self.running)),
+            self.loop.create_task(self.watchdog.run(self.running)),
+            self.loop.create_task(self.outbound.run(self.running)),
+            self.loop.create_task(self.db.ledger.run(self.running))
+        ]
+        if self.eventsub is not None:
+            loops.append(self.loop.create_task(self.eventsub.run()))
 
-                update_loop = None
-                while True:
-                    if update_loop is None or update_loop.done():
-                        update_loop = self.loop.create_task(self.run_update_loop())
-
-                    await self.receive()
+        try:
+            await self.irc.run()
 
         except KeyboardInterrupt:
             self.running.clear()
@@ -74,74 +118,39 @@ class BaseBot:
         except Exception as exc:
             log.exception(exc)
 
-    async def run_update_loop(self):
-        while self.running.is_set():
-            await asyncio.sleep(1)
-            await self.manager.queue_ctx(UnknownContext(None, ContextType.UPDATE))
-
-    async def receive(self):
-        while self.running.is_set():
-            data = await self.ws.recv()
-
-            if data.startswith("PING"):
-                await self.ws.send("PONG :tmi.twitch.tv")
-                continue
-
-            # Account for tags
-            ctxs = get_contexts(data)
-
-            for ctx in ctxs:
-                await self.manager.queue_ctx(ctx)
-
-    async def connect(self):
-        log.info(f"Connecting to irc server as {self.IRC_USERNAME}")
-        await self.ws.send(f"PASS {self.IRC_OAUTH}")
-        await self.ws.send(f"NICK {self.IRC_USERNAME}")
+        finally:
+            for task in loops:
+                task.cancel()
+            # e.g. the ledger puts back changes it was writing when cancelled
+            await asyncio.gather(*loops, return_exceptions=True)
 
     async def join(self, channel):
-        log.info(f"Joining #{channel}")
-        await self.ws.send(f"JOIN #{channel.lower()}")
+        self.irc.join(channel)
 
     async def part(self, channel):
-        log.info(f"Leaving #{channel}\r\n")
-        await self.ws.send(f"PART #{channel.lower()}\r\n")
+        log.info(f"Leaving #{channel}")
+        await self.irc.part(channel)
 
     async def register_cap(self, *caps):
         log.info(f"Registering capability '{caps}'")
-        caps = ' '.join([f'twitch.tv/{cap}' for cap in caps])
-        await self.ws.send(f"CAP REQ :{caps}\r\n")
+        await self.irc.register_cap(*caps)
 
-    async def send_message(self, channel, message):
+    async def send_message(self, channel, message, priority=MessagePriority.REPLY, coalesce=True) -> asyncio.Future:
+        """Queues the message and returns a future that's done once all parts of it are sent"""
         message = message.strip()
         while (i := message.find("  ")) != -1:
             message = message[:i] + message[i+1:]
 
-        await self.message_locks[channel].acquire()
-
-        messages = split_message(message)
-        for msg in messages:
-            log.info(f"Sending message in #{channel}: {msg}")
-
-            await self.ws.send(
-                f"PRIVMSG #{channel} :/me " + msg + (" \U000e0000" if self.last_message[channel] == msg else "")
-            )
-
-            self.last_message[channel] = msg
-
-            await asyncio.sleep(self.get_wait_for_channel(channel))  # Avoid going over ratelimits
-
-        self.message_locks[channel].release()
-
-        return messages
+        return self.outbound.queue(channel, message, priority, coalesce)
 
     # Util
 
-    def call_later(self, wait, callback, *args, **kwargs) -> asyncio.Task:
-        return self.loop.create_task(wait_and_call(wait, callback, *args, **kwargs))
+    def call_later(self, wait, callback, *args, **kwargs) -> Timer:
+        return self.timers.call_later(wait, callback, *args, **kwargs)
 
     async def create_periodic_message(self, channel, message, wait_time, offset):
         async def send_message():
-            await self.send_message(channel, message)
+            await self.send_message(channel, message, MessagePriority.PERIODIC)
             self.call_later(wait_time, send_message)
 
         if offset == 0:
@@ -149,17 +158,48 @@ class BaseBot:
         else:
             self.call_later(offset, send_message)
 
-    def get_wait_for_channel(self, channel):
-        # TODO: make a check for if the bot is a moderator in the channel
-        if channel == self.IRC_USERNAME or (self.own_state is not None and self.own_state.mod):
-            return 0.3
-        return 1.5
+    async def check_db_pool(self):
+        self.call_later(self.db.POOL_CHECK_INTERVAL, self.check_db_pool)
+        try:
+            await self.db.check_pool()
+        except Exception as exc:
+            log.exception("Failed to check the database pool", exc_info=exc)
+
+    async def reload_rank_index(self):
+        self.call_later(self.db.RANK_RELOAD_INTERVAL, self.reload_rank_index)
+        await self.db.load_rank_index()
+
+    def get_gauges(self) -> list[tuple[str, str, dict, float]]:
+        gauges = []
+        for channel, stats in self.manager.ctx_queue.stats().items():
+            labels = {"channel": channel or ""}
+            gauges.append(("bot_ctx_queue_depth", "gauge", labels, stats["depth"]))
+            gauges.append(("bot_ctx_queue_dropped_total", "counter", labels, stats["dropped"]))
+            gauges.append(("bot_ctx_queue_max_latency_seconds", "gauge", labels, stats["max_latency"]))
+
+        gauges.append(("bot_outbound_pending", "gauge", {}, sum(map(len, self.outbound.queues))))
+        gauges.append(("bot_timers_pending", "gauge", {}, self.timers.count))
+        gauges.append(("bot_loop_stalls_total", "counter", {}, self.watchdog.stalls))
+        gauges.append(("bot_loop_max_lag_seconds", "gauge", {}, self.watchdog.max_lag))
+        for key, value in self.db.get_stats().items():
+            gauges.append((f"bot_db_{key}", "gauge", {}, value))
+
+        return gauges
+
+    def render_metrics(self) -> str:
+        return self.metrics.render(self.get_gauges())
+
+    def is_mod_in(self, channel):
+        return channel == self.IRC_USERNAME or ((state := self.own_state.get(channel)) is not None and state.mod)
 
     # hooks
 
     async def on_setup(self, ctx):
         log.info("Running setup")
+        await self.db.open()
         await self.db.setup()
+        await self.reload_rank_index()
+        self.call_later(self.db.POOL_CHECK_INTERVAL, self.check_db_pool)
 
     async def on_connected(self, ctx):
         log.info("Connected to server")
@@ -180,12 +220,15 @@ class BaseBot:
         log.info(f"Parted {ctx.channel}")
 
     async def on_reconnect(self, ctx):
+        # the irc pool reconnects the connection and moves its channels
         log.info("Twitch requested the bot to reconnect")
-        self.running.clear()
 
     async def on_server_msg(self, ctx: ServerMessageContext):
         log.info(f"Received server message: {ctx.data!r}")
 
+    async def on_stream_status(self, ctx: StreamStatusContext):
+        log.info(f"#{ctx.channel} went {'online' if ctx.is_online else 'offline'}")
+
     def __getattribute__(self, name):
         try:
             return super().__getattribute__(name)
@@ -205,6 +248,19 @@ class BaseBot:
 BOT_CLASSES = []
 
 
+def ctx_filter(predicate):
+    """
+    Only schedule the decorated handler when predicate(bot, ctx) is true.
+    The predicate is called synchronously for every context, so it should be cheap.
+    """
+
+    def decorator(func):
+        func.ctx_filter = predicate
+        return func
+
+    return decorator
+
+
 class BotMeta(type):
     def __new__(cls, name, bases, attrs):
         attrs["dependencies"] = list()
@@ -222,7 +278,7 @@ class BotManager:
         bot_classes = list(BOT_CLASSES)
 
         self.loop = loop
-        self.ctx_queue: asyncio.Queue = asyncio.Queue()
+        self.ctx_queue: ShardedContextQueue = ShardedContextQueue()
 
         self.base_bot = base_bot = BaseBot(loop, self)
         self.running: asyncio.Event = self.base_bot.running
@@ -249,7 +305,6 @@ class BotManager:
 
         context_handlers = {
             ContextType.SETUP: "on_setup",
-            ContextType.UPDATE: "on_update",
             ContextType.CONNECTED: "on_connected",
             ContextType.JOIN: "on_join",
             ContextType.PART: "on_part",
@@ -257,11 +312,12 @@ class BotManager:
             ContextType.USERSTATE: "on_user_state",
             ContextType.ROOMSTATE: "on_room_state",
             ContextType.RECONNECT: "on_reconnect",
-            ContextType.SERVER_MSG: "on_server_msg"
+            ContextType.SERVER_MSG: "on_server_msg",
+            ContextType.STREAM_STATUS: "on_stream_status"
         }
         self.context_handlers = {
             ctx_type: [
-                func
+                (func, getattr(func, "ctx_filter", None))
                 for bot in bots.values()
                 if (func := getattr(bot, func_name, None)) is not None and
                 func.__func__.__qualname__.split(".")[-2] == func.__self__.__class__.__name__
@@ -276,28 +332,56 @@ class BotManager:
         await self.ctx_queue.put(ctx)
 
     async def run_ctx_handler(self):
+        metrics = self.base_bot.metrics
         while self.running.is_set():
-            ctx = await self.ctx_queue.get()
-            for handler in self.context_handlers.get(ctx.type, []):
+            queued_at, ctx = await self.ctx_queue.get()
+            ctx_type = ctx.type.name.lower()
+            for handler, handler_filter in self.context_handlers.get(ctx.type, []):
+                if handler_filter is not None:
+                    try:
+                        if not handler_filter(handler.__self__, ctx):
+                            continue
+                    except Exception as exc:
+                        log.exception(f"Exception in context filter of {handler.__qualname__}", exc_info=exc)
+                        continue
+
                 if ctx.type == ContextType.SETUP:
-                    await handler(ctx)
+                    await metrics.run_handler(ctx_type, handler, ctx, queued_at)
                 else:
-                    self.loop.create_task(handler(ctx))
+                    self.loop.create_task(metrics.run_handler(ctx_type, handler, ctx, queued_at))
 
     async def run(self):
         self.running.set()
 
         server = MessageServer(self.loop, self.ctx_queue)
+        metrics_server = MetricsServer(self.base_bot.render_metrics) if MetricsServer.PORT else None
 
         await self.ctx_queue.put(UnknownContext(None, ContextType.SETUP))
 
         server_task = None
+        metrics_task = None
         ctx_handler_task = None
-        while self.running.is_set():
-            if server_task is None or server_task.done():
-                server_task = self.loop.create_task(server.run())
+        try:
+            while self.running.is_set():
+                if server_task is None or server_task.done():
+                    server_task = self.loop.create_task(server.run())
+
+                if metrics_server is not None and (metrics_task is None or metrics_task.done()):
+                    metrics_task = self.loop.create_task(metrics_server.run())
+
+                if ctx_handler_task is None or ctx_handler_task.done():
+                    ctx_handler_task = self.loop.create_task(self.run_ctx_handler())
 
-            if ctx_handler_task is None or ctx_handler_task.done():
-                ctx_handler_task = self.loop.create_task(self.run_ctx_handler())
+                await self.base_bot.run()
+        finally:
+            for task in (server_task, metrics_task, ctx_handler_task):
+                if task is not None:
+                    task.cancel()
+
+    def stop(self):
+        log.info("Shutting down")
+        self.running.clear()
 
-            await self.base_bot.run()
+    async def close(self):
+        await self.base_bot.db.close()
+        await self.base_bot.http.close()
@@ -12,6 +12,7 @@ from .reminder import ReminderBot
 from .rps import RPSBot
 from .settings import SettingsBot
 from .static_data import StaticDataBot
+from .stats import StatsBot
 from .timezone import TimezoneBot
 from .trivia import TriviaBot
 from .user_data import UserDataBot
@@ -2,31 +2,79 @@ from .base import CommandBot, CommandArg
 from ..context import MessageContext
 from ..database import UserAfk
 from ..util import format_date
-from ..bot import BotMeta
+from ..bot import BotMeta, ctx_filter
 
+from contextlib import asynccontextmanager
 from time import time
 import asyncio
+import re
+
+
+MENTION_RE = re.compile(r"(?<!\S)@([a-zA-Z0-9_]+)")
+
+
+class UserLock:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock: asyncio.Lock = asyncio.Lock()
+        # holding or waiting on the lock
+        self.users: int = 0
 
 
 class AFKBot(CommandBot, metaclass=BotMeta):
-    __slots__ = ("afks", "_lock")
+    __slots__ = ("afks", "afks_by_username", "_locks")
 
     command_manager = CommandBot.command_manager
 
     def __init__(self):
-        self.afks: list[UserAfk] = None  # type: ignore
-        self._lock: asyncio.Lock = asyncio.Lock()
-
+        # user id -> afk
+        self.afks: dict[int, UserAfk] = {}
+        # lowercase username -> afk
+        self.afks_by_username: dict[str, UserAfk] = {}
+        # only changes to the same user's afk need to wait on each other
+        self._locks: dict[int, UserLock] = {}
+
+    @ctx_filter(lambda self, ctx: "@" in ctx.message or ctx.user_id in self.afks)
     async def on_message(self, ctx: MessageContext):
         if not self.can_respond(ctx):
             return
 
-        await self._lock.acquire()
         await self.on_afk(ctx)
-        self._lock.release()
 
     async def on_setup(self, ctx):
-        self.afks = await self.db.get_afks()
+        self.afks.clear()
+        self.afks_by_username.clear()
+        for afk in await self.db.get_afks():
+            self.add_afk(afk)
+
+    def add_afk(self, afk: UserAfk):
+        if (old_afk := self.afks.get(afk.user.id)) is not None:
+            self.afks_by_username.pop(old_afk.user.username.lower(), None)
+
+        self.afks[afk.user.id] = afk
+        self.afks_by_username[afk.user.username.lower()] = afk
+
+    def pop_afk(self, user_id: int) -> UserAfk | None:
+        afk = self.afks.pop(user_id, None)
+        if afk is not None and self.afks_by_username.get(username := afk.user.username.lower()) is afk:
+            del self.afks_by_username[username]
+        return afk
+
+    @asynccontextmanager
+    async def lock_user(self, user_id: int):
+        if (user_lock := self._locks.get(user_id)) is None:
+            user_lock = self._locks[user_id] = UserLock()
+
+        user_lock.users += 1
+        try:
+            async with user_lock.lock:
+                yield
+        finally:
+            user_lock.users -= 1
+            # made again the next time it's needed
+            if user_lock.users == 0:
+                del self._locks[user_id]
 
     @command_manager.command(
         "afk",
@@ -39,16 +87,11 @@ class AFKBot(CommandBot, metaclass=BotMeta):
         ]
     )
     async def afk(self, ctx: MessageContext):
-        await self._lock.acquire()
-
         args = ctx.get_args()
         message = " ".join(args)
 
-        self.afks.append(
-            await self.db.set_afk(ctx.user_id, ctx.sending_user, message)
-        )
-
-        self._lock.release()
+        async with self.lock_user(ctx.user_id):
+            self.add_afk(await self.db.set_afk(ctx.user_id, ctx.sending_user, message))
 
         await self.send_message(ctx.channel, f"@{ctx.user.display_name} Your afk has been set.")
 
@@ -58,46 +101,37 @@ class AFKBot(CommandBot, metaclass=BotMeta):
         aliases=["rafk", "afkremove", "afkr", "unafk"]
     )
     async def afk_remove(self, ctx):
-        await self._lock.acquire()
-
-        for afk in self.afks:
-            if afk.user.id == ctx.user_id:
-                await self.remove_user_afk(ctx, afk)
-                self._lock.release()
-                return
-
-        self._lock.release()
+        async with self.lock_user(ctx.user_id):
+            if (afk := self.afks.get(ctx.user_id)) is not None:
+                return await self.remove_user_afk(ctx, afk)
 
         await self.send_message(ctx.channel, f"@{ctx.user.display_name} You are not afk")
 
     async def on_afk(self, ctx):
-        pings = set([
-            word.replace("@", "")
-            for word in ctx.message.lower().replace(",", "").replace(".", "").replace("-", "").split()
-            if word.startswith("@")
-        ])
-        for ping in pings:
-            for afk in self.afks:
-                if afk.user.username == ping:
+        if "@" in ctx.message:
+            for ping in {mention.lower() for mention in MENTION_RE.findall(ctx.message)}:
+                if (afk := self.afks_by_username.get(ping)) is not None:
                     await self.send_message(
                         ctx.channel,
                         f"@{ctx.user.display_name} {ping} is afk ({format_date(afk.timestamp)} ago): {afk.msg}"
                     )
-                    break
 
-        afk = next((afk for afk in self.afks if afk.user.id == ctx.user_id), None)
-        if afk is None:
+        if ctx.user_id not in self.afks:
             return
 
-        user = await self.db.get_user(ctx.user_id, ctx.sending_user)
-        if not user.auto_remove_afk:
-            return
+        async with self.lock_user(ctx.user_id):
+            # could have been removed while waiting
+            afk = self.afks.get(ctx.user_id)
+            if afk is None or time() - afk.timestamp <= 60:
+                return
 
-        if time() - afk.timestamp > 60:
-            await self.remove_user_afk(ctx, afk)
+            user = await self.db.get_user(ctx.user_id, ctx.sending_user)
+            if user.auto_remove_afk:
+                await self.remove_user_afk(ctx, afk)
 
     async def remove_user_afk(self, ctx: MessageContext, afk: UserAfk):
-        self.afks.remove(afk)
+        """Should be called while holding the user's lock"""
+        self.pop_afk(afk.user.id)
         await self.db.remove_afk(afk.id)
         await self.send_message(
             ctx.channel,
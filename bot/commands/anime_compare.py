@@ -1,7 +1,7 @@
 from .static_data import StaticDataBot
 from .base import Cooldown
 from ..context import MessageContext
-from ..bot import BotMeta
+from ..bot import BotMeta, ctx_filter
 from ..database import Database, AnimeCompareGame
 
 import random
@@ -182,6 +182,7 @@ class AnimeCompareBot(StaticDataBot, metaclass=BotMeta):
         self.helper: AnimeCompare = AnimeCompare(self.db, self.anime)
         self.futures: dict[int, asyncio.Future] = {}
 
+    @ctx_filter(lambda self, ctx: ctx.message[:1] in ("1", "2"))
     async def on_message(self, ctx: MessageContext):
         num = ctx.message[0]
         if num != "1" and num != "2":
@@ -1,6 +1,7 @@
-from ..context import MessageContext, JoinContext, UserStateContext
-from ..bot import BaseBot, BotMeta
-from ..database import UserChannel
+from ..context import MessageContext, JoinContext, UserStateContext, StreamStatusContext
+from ..bot import BaseBot, BotMeta, ctx_filter
+from ..outbound import MessagePriority
+from ..database import UserChannel, ChannelCommand
 
 from collections import namedtuple, defaultdict
 from typing import Callable, Awaitable
@@ -100,10 +101,12 @@ class CallableCommand:
 
 
 class CommandManager:
-    __slots__ = ("commands",)
+    __slots__ = ("commands", "command_index")
 
     def __init__(self):
         self.commands: list[CallableCommand] = []
+        # name and aliases -> command
+        self.command_index: dict[str, CallableCommand] = {}
 
     def command(
         self,
@@ -122,31 +125,56 @@ class CommandManager:
             cooldown = Cooldown(1, 3)
 
         def decorator(func):
-            self.commands.append(CallableCommand(func, name, description, args, aliases, cooldown, **kwargs))
+            self.add_command(CallableCommand(func, name, description, args, aliases, cooldown, **kwargs))
 
             return func
 
         return decorator
 
+    def add_command(self, cmd: CallableCommand):
+        self.commands.append(cmd)
+
+        # the first registered command keeps a name in case of collisions
+        for name in (cmd.name, *cmd.aliases):
+            self.command_index.setdefault(name, cmd)
+
     def get_command(self, name: str) -> CallableCommand | None:
-        return next((cmd for cmd in self.commands if cmd.name == name or name in cmd.aliases), None)
+        return self.command_index.get(name)
 
 
 class CommandBot(BaseBot, metaclass=BotMeta):
-    __slots__ = ("channels", "offline_channels", "last_checked_live")
+    __slots__ = ("channels", "channel_commands", "offline_channels", "stream_check_failures")
 
     command_manager = CommandManager()
 
+    STREAM_CHECK_INTERVAL = 10
+    # backs off up to this while requests are failing
+    STREAM_CHECK_MAX_INTERVAL = 120
+    STREAM_CHECK_JITTER = 0.1
+    # max user ids per helix/streams request
+    STREAMS_PAGE_SIZE = 100
+
     def __init__(self):
         self.channels: list[UserChannel] = None
+        # (room id, command name) -> channel command
+        self.channel_commands: dict[tuple[int, str], ChannelCommand] = {}
         self.offline_channels: dict[str, bool] = None
-
-        self.last_checked_live: float = monotonic()
-
-    async def on_update(self, ctx):
-        if monotonic() - self.last_checked_live >= 10:
-            self.last_checked_live = monotonic()
-            await self.update_stream_statuses()
+        self.stream_check_failures: int = 0
+
+    async def check_stream_statuses(self):
+        try:
+            # with eventsub, only the channels it's missing events for need polling
+            user_ids = None if self.eventsub is None else self.eventsub.get_unsubscribed()
+            if user_ids is not None and len(user_ids) == 0:
+                self.stream_check_failures = 0
+            elif await self.update_stream_statuses(user_ids):
+                self.stream_check_failures = 0
+            else:
+                self.stream_check_failures += 1
+        finally:
+            interval = min(self.STREAM_CHECK_INTERVAL * 2 ** self.stream_check_failures, self.STREAM_CHECK_MAX_INTERVAL)
+            jitter = random.uniform(1 - self.STREAM_CHECK_JITTER, 1 + self.STREAM_CHECK_JITTER)
+            self.call_later(interval * jitter, self.check_stream_statuses)
 
     async def on_setup(self, ctx):
         await self.db.sync_commands(self.command_manager.commands)
@@ -156,12 +184,36 @@ class CommandBot(BaseBot, metaclass=BotMeta):
         else:
             self.channels = [ch for ch in await self.db.get_channels() if ch.is_enabled]
 
-        self.offline_channels = {
-            channel.user.username: False
-            for channel in self.channels
-            if channel.is_offline_only
-        }
-        await self.update_stream_statuses()
+        self.channel_commands.clear()
+        for channel in self.channels:
+            self.index_channel(channel)
+
+        self.offline_channels = {}
+        await asyncio.gather(*(self.watch_stream(channel) for channel in self.channels if channel.is_offline_only))
+
+        if self.eventsub is None:
+            await self.check_stream_statuses()
+        else:
+            # only needs a full check for the initial state, and after eventsub has been disconnected
+            self.eventsub.on_subscribed = self.update_stream_statuses
+            await self.update_stream_statuses()
+            # channels eventsub couldn't subscribe to are still polled
+            self.call_later(self.STREAM_CHECK_INTERVAL, self.check_stream_statuses)
+
+    async def on_stream_status(self, ctx: StreamStatusContext):
+        if ctx.channel in self.offline_channels:
+            self.offline_channels[ctx.channel] = not ctx.is_online
+
+    async def watch_stream(self, channel: UserChannel):
+        """Start tracking whether an offline-only channel is live"""
+        self.offline_channels.setdefault(channel.user.username, False)
+        if self.eventsub is not None:
+            await self.eventsub.subscribe(channel.user.id, channel.user.username)
+
+    async def unwatch_stream(self, channel: UserChannel):
+        self.offline_channels.pop(channel.user.username, None)
+        if self.eventsub is not None:
+            await self.eventsub.unsubscribe(channel.user.id)
 
     async def on_connected(self, ctx):
         await self.register_cap("tags")
@@ -170,20 +222,20 @@ class CommandBot(BaseBot, metaclass=BotMeta):
             await self.join(channel.user.username)
 
     async def on_user_state(self, ctx: UserStateContext):
-        if ctx.username == self.IRC_USERNAME:
-            self.own_state = ctx
+        # twitch only sends user state for our own user
+        self.own_state[ctx.channel] = ctx
 
     async def on_join(self, ctx: JoinContext):
         # probably reconnecting to the channel
-        if ctx.channel in self.message_locks:
+        if ctx.channel in self.last_message:
             return
 
-        self.message_locks[ctx.channel] = asyncio.Lock()
         self.last_message[ctx.channel] = ""
 
     async def on_reconnect(self, ctx):
         self.running = False
 
+    @ctx_filter(lambda self, ctx: "!" in ctx.message)
     async def on_message(self, ctx: MessageContext):
         if not self.can_respond(ctx):
             return
@@ -199,9 +251,8 @@ class CommandBot(BaseBot, metaclass=BotMeta):
             if callable_cmd is None or not callable_cmd.can_use(ctx):
                 return
 
-            channel = next((channel for channel in self.channels if channel.user.id == ctx.room_id))
-            cmd = next((ch_cmd for ch_cmd in channel.commands if ch_cmd.command.name == callable_cmd.name))
-            if not cmd.is_enabled:
+            cmd = self.channel_commands.get((ctx.room_id, callable_cmd.name))
+            if cmd is None or not cmd.is_enabled:
                 return
 
             def done_callback(task):
@@ -215,14 +266,17 @@ class CommandBot(BaseBot, metaclass=BotMeta):
                         )
                     )
 
-            task = self.loop.create_task(callable_cmd(self.manager.get_bot_for(callable_cmd.function), ctx))
+            task = self.loop.create_task(self.metrics.run_command(
+                callable_cmd.name,
+                callable_cmd(self.manager.get_bot_for(callable_cmd.function), ctx)
+            ))
             task.add_done_callback(done_callback)
 
-    async def send_message(self, channel, message):
+    async def send_message(self, channel, message, priority=MessagePriority.REPLY, coalesce=True):
         if not self.can_send_in_channel(channel):
             return
 
-        return await super().send_message(channel, message)
+        return await super().send_message(channel, message, priority, coalesce)
 
     # Util
 
@@ -232,30 +286,52 @@ class CommandBot(BaseBot, metaclass=BotMeta):
     def can_send_in_channel(self, channel: str) -> bool:
         return self.offline_channels.get(channel, True)
 
-    async def update_stream_statuses(self):
-        # TODO: account for limit of 100
-        channels = [
-            channel.user.id
+    def index_channel(self, channel: UserChannel):
+        for ch_cmd in channel.commands:
+            self.channel_commands[(channel.user.id, ch_cmd.command.name)] = ch_cmd
+
+    def unindex_channel(self, channel: UserChannel):
+        for ch_cmd in channel.commands:
+            key = (channel.user.id, ch_cmd.command.name)
+            # only remove the entry if it wasn't already replaced by a newer version of the channel
+            if self.channel_commands.get(key) is ch_cmd:
+                del self.channel_commands[key]
+
+    async def update_stream_statuses(self, user_ids: set[int] | None = None) -> bool:
+        """
+        Checks the given channels, or all of them. Returns whether every page was fetched.
+        Channels in a failed page keep their last known state.
+        """
+        channels = {
+            channel.user.id: channel.user.username
             for channel in self.channels
-            if channel.is_offline_only
+            if channel.is_offline_only and (user_ids is None or channel.user.id in user_ids)
+        }
+        user_ids = list(channels.keys())
+        pages = [
+            user_ids[i:i+self.STREAMS_PAGE_SIZE]
+            for i in range(0, len(user_ids), self.STREAMS_PAGE_SIZE)
         ]
-        params = {"user_id": channels}
 
-        data = await self.twitch_client.get("helix/streams", params=params)
-        if data is None:
-            for channel in self.offline_channels.keys():
-                self.offline_channels[channel] = False
+        results = await asyncio.gather(*(
+            self.twitch_client.get("helix/streams", params={"user_id": page, "first": self.STREAMS_PAGE_SIZE})
+            for page in pages
+        ))
 
-            return
+        success = True
+        for page, data in zip(pages, results):
+            if data is None:
+                success = False
+                continue
 
-        data = data["data"]
-        online_streams = [int(user["user_id"]) for user in data]
+            online_streams = {int(user["user_id"]) for user in data["data"]}
+            for user_id in page:
+                self.offline_channels[channels[user_id]] = user_id not in online_streams
 
-        for channel in self.channels:
-            if not channel.is_offline_only:
-                continue
+        if not success:
+            log.warning("Failed to fetch some stream statuses, keeping their last known state")
 
-            self.offline_channels[channel.user.username] = channel.user.id not in online_streams
+        return success
 
     def process_value_arg(self, flag, args, default=None):
         lower_args = list(map(str.lower, args))
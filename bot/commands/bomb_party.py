@@ -3,7 +3,7 @@
 from .base import Cooldown, CommandArg
 from .static_data import StaticDataBot
 from ..context import MessageContext
-from ..bot import BotMeta
+from ..bot import BotMeta, ctx_filter
 
 import random
 import json
@@ -204,6 +204,7 @@ class BombPartyBot(StaticDataBot, metaclass=BotMeta):
         self.bomb_party_future = None
         self.exploding = False
 
+    @ctx_filter(lambda self, ctx: self.bomb_party_helper.started)
     async def on_message(self, ctx: MessageContext):
         if self.bomb_party_helper.started:
             await self.on_bomb_party(ctx)
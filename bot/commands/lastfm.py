@@ -1,7 +1,7 @@
 from .base import CommandBot, CommandArg
 from ..bot import BotMeta
+from ..http_client import HTTPClient
 
-import requests
 import os
 import logging
 
@@ -11,7 +11,10 @@ log = logging.getLogger(__name__)
 
 
 class LastFMClient:
-    def __init__(self):
+    API_URL = "http://ws.audioscrobbler.com/2.0/"
+
+    def __init__(self, http: HTTPClient):
+        self.http: HTTPClient = http
         self.lastfm_token = lastfm_token
 
     def get_params(self, method, **kwargs):
@@ -22,22 +25,22 @@ class LastFMClient:
             **kwargs
         }
 
-    def return_response(self, resp):
+    async def make_request(self, params):
         try:
-            resp.raise_for_status()
-            return resp.json()
+            async with self.http.get(self.API_URL, params=params) as resp:
+                if resp.status != 200:
+                    log.error(f"Lastfm request failed: {resp.status}\n{await resp.text()}")
+                    return
+
+                return await resp.json()
         except Exception as err:
-            log.error(f"Lastfm request failed: {err}\n{resp.text}")
+            log.error(f"Lastfm request failed: {err}")
 
-    def get_lastfm_user(self, user):
-        params = self.get_params("user.getinfo", user=user)
-        resp = requests.get("http://ws.audioscrobbler.com/2.0/", params=params)
-        return self.return_response(resp)
+    async def get_lastfm_user(self, user):
+        return await self.make_request(self.get_params("user.getinfo", user=user))
 
-    def get_recent_song(self, user):
-        params = self.get_params("user.getrecenttracks", user=user, extended=1, limit=1)
-        resp = requests.get("http://ws.audioscrobbler.com/2.0/", params)
-        return self.return_response(resp)
+    async def get_recent_song(self, user):
+        return await self.make_request(self.get_params("user.getrecenttracks", user=user, extended=1, limit=1))
 
 
 class LastFMBot(CommandBot, metaclass=BotMeta):
@@ -46,7 +49,7 @@ class LastFMBot(CommandBot, metaclass=BotMeta):
     command_manager = CommandBot.command_manager
 
     def __init__(self):
-        self.lastfm = LastFMClient()
+        self.lastfm = LastFMClient(self.http)
 
     @command_manager.command(
         "lastfm_link",
@@ -62,7 +65,7 @@ class LastFMBot(CommandBot, metaclass=BotMeta):
             return await self.send_message(ctx.channel, f"@{ctx.user.display_name} Please specify a username.")
 
         username = " ".join(args).strip()
-        user = self.lastfm.get_lastfm_user(username)
+        user = await self.lastfm.get_lastfm_user(username)
 
         if user is None:
             return await self.send_message(ctx.channel, f"@{ctx.user.display_name} User {username} not found.")
@@ -85,7 +88,7 @@ class LastFMBot(CommandBot, metaclass=BotMeta):
                 f"you can do !fmlink *username* to link your account."
             )
 
-        recent_song = self.lastfm.get_recent_song(lastfm_user.username)
+        recent_song = await self.lastfm.get_recent_song(lastfm_user.username)
 
         if "@attr" in recent_song['recenttracks']['track'][0]:
             song_title = recent_song['recenttracks']['track'][0]['name']
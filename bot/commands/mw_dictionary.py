@@ -4,7 +4,6 @@ from ..bot import BotMeta
 
 import os
 import logging
-from aiohttp import ClientSession
 
 
 log = logging.getLogger(__name__)
@@ -175,13 +174,12 @@ class MWBot(CommandBot, metaclass=BotMeta):
             return value
 
         base, key = ("collegiate", self.MWD_API_KEY) if dictionary else ("thesaurus", self.MWT_API_KEY)
-        async with ClientSession() as session:
-            async with session.get(f"https://www.dictionaryapi.com/api/v3/references/{base}/json/{endpoint}?key={key}") as resp:
-                if resp.status == 200:
-                    cache[endpoint.lower()] = (data := await resp.json())
-                    return data
+        async with self.http.get(f"https://www.dictionaryapi.com/api/v3/references/{base}/json/{endpoint}?key={key}") as resp:
+            if resp.status == 200:
+                cache[endpoint.lower()] = (data := await resp.json())
+                return data
 
-                log.error(f"mw returned {resp.status}: {await resp.text()}")
+            log.error(f"mw returned {resp.status}: {await resp.text()}")
 
     async def on_join(self, ctx: JoinContext):
         self.mw_cache["args"][ctx.channel] = {"word": "", "index": 1}
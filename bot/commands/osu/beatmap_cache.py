@@ -0,0 +1,153 @@
+from collections import OrderedDict
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+
+
+log = logging.getLogger(__name__)
+
+
+def get_checksum(content: bytes) -> str:
+    # same as the checksum the osu api gives for beatmaps
+    return hashlib.md5(content).hexdigest()
+
+
+class MemoryBeatmapCache:
+    """LRU of raw .osu files, bounded by their total size"""
+
+    __slots__ = ("max_size", "size", "entries")
+
+    def __init__(self, max_size: int):
+        self.max_size: int = max_size
+        self.size: int = 0
+        # beatmap id -> (checksum, content)
+        self.entries: OrderedDict[int, tuple[str, bytes]] = OrderedDict()
+
+    def get(self, beatmap_id: int, checksum: str | None = None) -> bytes | None:
+        entry = self.entries.get(beatmap_id)
+        if entry is None or (checksum is not None and entry[0] != checksum):
+            return
+
+        self.entries.move_to_end(beatmap_id)
+        return entry[1]
+
+    def put(self, beatmap_id: int, checksum: str, content: bytes):
+        if len(content) > self.max_size:
+            return
+
+        if (old := self.entries.pop(beatmap_id, None)) is not None:
+            self.size -= len(old[1])
+
+        self.entries[beatmap_id] = (checksum, content)
+        self.size += len(content)
+        while self.size > self.max_size:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+
+class DiskBeatmapCache:
+    """
+    Directory of .osu files named by beatmap id and checksum, bounded by
+    their total size. The least recently used files are deleted first.
+    File operations are run in a thread so they don't block the loop.
+    """
+
+    __slots__ = ("directory", "max_size", "size", "entries", "loading")
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory: str = directory
+        self.max_size: int = max_size
+        self.size: int = 0
+        # beatmap id -> (checksum, file size)
+        self.entries: OrderedDict[int, tuple[str, int]] = OrderedDict()
+        self.loading: asyncio.Future | None = None
+
+    def get_path(self, beatmap_id: int, checksum: str) -> str:
+        return os.path.join(self.directory, f"{beatmap_id}-{checksum}.osu")
+
+    def load(self):
+        files = []
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for entry in os.scandir(self.directory):
+                name, ext = os.path.splitext(entry.name)
+                beatmap_id, _, checksum = name.partition("-")
+                if ext != ".osu" or not beatmap_id.isdigit() or len(checksum) == 0:
+                    continue
+
+                stat = entry.stat()
+                files.append((stat.st_mtime, int(beatmap_id), checksum, stat.st_size))
+        except OSError as exc:
+            log.warning(f"Failed to load the beatmap cache in {self.directory}: {exc}")
+
+        # oldest first so they're the first to go
+        for _, beatmap_id, checksum, size in sorted(files):
+            self.add_entry(beatmap_id, checksum, size)
+
+        log.info(f"Loaded {len(self.entries)} cached beatmaps ({self.size / 1024 / 1024:.1f}MB)")
+
+    def add_entry(self, beatmap_id: int, checksum: str, size: int) -> list[str]:
+        """Returns paths of files that should be removed"""
+        remove = []
+        if (old := self.entries.pop(beatmap_id, None)) is not None:
+            self.size -= old[1]
+            if old[0] != checksum:
+                remove.append(self.get_path(beatmap_id, old[0]))
+
+        self.entries[beatmap_id] = (checksum, size)
+        self.size += size
+        while self.size > self.max_size:
+            evicted_id, (evicted_checksum, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            remove.append(self.get_path(evicted_id, evicted_checksum))
+
+        return remove
+
+    async def ensure_loaded(self):
+        if self.loading is None:
+            self.loading = asyncio.ensure_future(asyncio.to_thread(self.load))
+        await self.loading
+
+    def read(self, path: str) -> bytes:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[:]
+
+    def write(self, path: str, content: bytes, remove: list[str]):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+        for old_path in remove:
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+
+    async def get(self, beatmap_id: int, checksum: str | None = None) -> tuple[str, bytes] | None:
+        await self.ensure_loaded()
+
+        entry = self.entries.get(beatmap_id)
+        if entry is None or (checksum is not None and entry[0] != checksum):
+            return
+
+        self.entries.move_to_end(beatmap_id)
+        try:
+            return entry[0], await asyncio.to_thread(self.read, self.get_path(beatmap_id, entry[0]))
+        except (OSError, ValueError) as exc:
+            # ValueError is from mmap on an empty file
+            log.warning(f"Failed to read cached beatmap {beatmap_id}: {exc}")
+            if self.entries.get(beatmap_id) == entry:
+                del self.entries[beatmap_id]
+                self.size -= entry[1]
+
+    async def put(self, beatmap_id: int, checksum: str, content: bytes):
+        await self.ensure_loaded()
+
+        remove = self.add_entry(beatmap_id, checksum, len(content))
+        try:
+            await asyncio.to_thread(self.write, self.get_path(beatmap_id, checksum), content, remove)
+        except OSError as exc:
+            log.warning(f"Failed to cache beatmap {beatmap_id}: {exc}")
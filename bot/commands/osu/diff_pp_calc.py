@@ -1,95 +1,329 @@
 from __future__ import annotations
 
-import beatmap_reader as br
 import rosu_pp_py as rosu
-from collections import namedtuple
-from aiohttp import ClientSession
+from collections import namedtuple, OrderedDict
 import logging
 import osu
 import asyncio
+import os
+import re
+from time import monotonic
+
+from ...http_client import HTTPClient
+from ...outbound import TokenBucket
+from .beatmap_cache import MemoryBeatmapCache, DiskBeatmapCache, get_checksum
 
 
 log = logging.getLogger(__name__)
 
 
 class BeatmapFileManager:
-    __slots__ = ("_lock",)
+    """
+    Gets .osu files from memory, then the disk cache, then osu.ppy.sh.
+    Concurrent requests for the same beatmap share one lookup, and
+    downloads of different beatmaps run in parallel up to a limit.
+    """
+
+    __slots__ = (
+        "http", "memory_cache", "disk_cache", "in_flight", "downloads", "download_slots", "rate_limit", "mismatches"
+    )
+
+    CACHE_DIR = os.getenv("BEATMAP_CACHE_DIR") or "beatmap_cache"
+    # in megabytes
+    MEMORY_CACHE_SIZE = int(os.getenv("BEATMAP_MEMORY_CACHE_SIZE") or 64)
+    DISK_CACHE_SIZE = int(os.getenv("BEATMAP_DISK_CACHE_SIZE") or 1024)
+    # to go easy on osu.ppy.sh
+    MAX_DOWNLOADS = 4
+    DOWNLOAD_LIMIT = 10
+    DOWNLOAD_PERIOD = 5
+    # how long a download that didn't match the expected checksum is used instead of downloading again
+    MISMATCH_TTL = 600
+
+    def __init__(self, http: HTTPClient):
+        self.http: HTTPClient = http
+        self.memory_cache: MemoryBeatmapCache = MemoryBeatmapCache(self.MEMORY_CACHE_SIZE * 1024 * 1024)
+        self.disk_cache: DiskBeatmapCache = DiskBeatmapCache(self.CACHE_DIR, self.DISK_CACHE_SIZE * 1024 * 1024)
+        self.in_flight: dict[tuple[int, str | None], asyncio.Future] = {}
+        self.downloads: dict[int, asyncio.Future] = {}
+        self.download_slots: asyncio.Semaphore = asyncio.Semaphore(self.MAX_DOWNLOADS)
+        self.rate_limit: TokenBucket = TokenBucket(self.DOWNLOAD_LIMIT, self.DOWNLOAD_PERIOD)
+        # (beatmap id, expected checksum) -> (checksum of the downloaded file, expires at)
+        self.mismatches: dict[tuple[int, str], tuple[str, float]] = {}
+
+    def resolve_checksum(self, beatmap_id: int, checksum: str | None) -> str | None:
+        """Checksum of the file to use for the expected one, which differs if it recently couldn't be downloaded"""
+        if checksum is None or (mismatch := self.mismatches.get((beatmap_id, checksum))) is None:
+            return checksum
+
+        if mismatch[1] <= monotonic():
+            del self.mismatches[(beatmap_id, checksum)]
+            return checksum
+        return mismatch[0]
+
+    def add_mismatch(self, beatmap_id: int, checksum: str, file_checksum: str):
+        now = monotonic()
+        self.mismatches = {key: value for key, value in self.mismatches.items() if value[1] > now}
+        self.mismatches[(beatmap_id, checksum)] = (file_checksum, now + self.MISMATCH_TTL)
+
+    async def get_beatmap_file(self, beatmap_id: int, checksum: str | None = None) -> bytes | None:
+        """If checksum is given, a cached file is only used if it matches"""
+        checksum = self.resolve_checksum(beatmap_id, checksum)
+        if (content := self.memory_cache.get(beatmap_id, checksum)) is not None:
+            return content
+
+        key = (beatmap_id, checksum)
+        if (future := self.in_flight.get(key)) is None:
+            future = self.in_flight[key] = asyncio.ensure_future(self._get_beatmap_file(beatmap_id, checksum))
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+
+        # shielded so one caller being cancelled doesn't cancel it for the others
+        return await asyncio.shield(future)
+
+    async def _get_beatmap_file(self, beatmap_id: int, checksum: str | None) -> bytes | None:
+        if (cached := await self.disk_cache.get(beatmap_id, checksum)) is not None:
+            self.memory_cache.put(beatmap_id, *cached)
+            return cached[1]
+
+        content = await self.download_beatmap_file(beatmap_id)
+        if content is None or len(content) == 0:
+            return content
+
+        file_checksum = get_checksum(content)
+        if checksum is not None and file_checksum != checksum:
+            log.warning(
+                f"Downloaded beatmap {beatmap_id} has checksum {file_checksum} instead of {checksum}, "
+                f"using it for the next {self.MISMATCH_TTL}s"
+            )
+            # otherwise every lookup would download it again
+            self.add_mismatch(beatmap_id, checksum, file_checksum)
+
+        self.memory_cache.put(beatmap_id, file_checksum, content)
+        await self.disk_cache.put(beatmap_id, file_checksum, content)
+        return content
+
+    async def download_beatmap_file(self, beatmap_id: int) -> bytes | None:
+        # lookups with different checksums can still share the download
+        if (future := self.downloads.get(beatmap_id)) is None:
+            future = self.downloads[beatmap_id] = asyncio.ensure_future(self._download_beatmap_file(beatmap_id))
+            future.add_done_callback(lambda _: self.downloads.pop(beatmap_id, None))
+
+        return await asyncio.shield(future)
+
+    async def _download_beatmap_file(self, beatmap_id: int) -> bytes | None:
+        async with self.download_slots:
+            while (wait := self.rate_limit.get_wait(monotonic())) > 0:
+                await asyncio.sleep(wait)
+            self.rate_limit.take(monotonic())
+
+            async with self.http.get(f"https://osu.ppy.sh/osu/{beatmap_id}") as resp:
+                try:
+                    resp.raise_for_status()
+                except Exception as e:
+                    log.exception(f"Failed to get osu beatmap", exc_info=e)
+                    return
+                return await resp.read()
+
+
+class BeatmapMetadata:
+    __slots__ = (
+        "title", "title_unicode", "artist", "artist_unicode", "creator", "version", "source", "tags",
+        "beatmap_id", "beatmapset_id"
+    )
+
+    def __init__(self, data: dict[str, str]):
+        self.title: str = data.get("Title", "")
+        self.title_unicode: str = data.get("TitleUnicode", self.title)
+        self.artist: str = data.get("Artist", "")
+        self.artist_unicode: str = data.get("ArtistUnicode", self.artist)
+        self.creator: str = data.get("Creator", "")
+        self.version: str = data.get("Version", "")
+        self.source: str = data.get("Source", "")
+        self.tags: list[str] = data.get("Tags", "").split()
+        self.beatmap_id: int | None = int(data["BeatmapID"]) if data.get("BeatmapID", "").isdigit() else None
+        self.beatmapset_id: int | None = int(data["BeatmapSetID"]) if data.get("BeatmapSetID", "").isdigit() else None
+
+
+class BeatmapDifficulty:
+    __slots__ = ("hp_drain_rate", "circle_size", "overall_difficulty", "approach_rate", "slider_multiplier", "slider_tick_rate")
+
+    def __init__(self, data: dict[str, str]):
+        self.hp_drain_rate: float = float(data.get("HPDrainRate", 5))
+        self.circle_size: float = float(data.get("CircleSize", 5))
+        self.overall_difficulty: float = float(data.get("OverallDifficulty", 5))
+        # old maps don't have it, and it was the same as od then
+        self.approach_rate: float = float(data.get("ApproachRate", self.overall_difficulty))
+        self.slider_multiplier: float = float(data.get("SliderMultiplier", 1.4))
+        self.slider_tick_rate: float = float(data.get("SliderTickRate", 1))
+
+
+class BeatmapInfo:
+    """
+    Reads the key-value sections of a .osu file when they're first used.
+    The file is scanned once for where each section is, and hit objects and
+    timing points are left alone since rosu parses those itself.
+    """
+
+    __slots__ = ("content", "version", "sections", "_metadata", "_difficulty")
+
+    SECTION_RE = re.compile(rb"^\[(\w+)\][ \t]*\r?$", re.MULTILINE)
+    VERSION_RE = re.compile(rb"osu file format v(\d+)")
+
+    def __init__(self, content: bytes):
+        self.content: bytes = content
+        self.version: int | None = int(match.group(1)) if (match := self.VERSION_RE.search(content, 0, 64)) else None
+
+        # section name -> (start, end) of its body
+        self.sections: dict[str, tuple[int, int]] = {}
+        last = None
+        for match in self.SECTION_RE.finditer(content):
+            if last is not None:
+                self.sections[last[0]] = (last[1], match.start())
+            last = (match.group(1).decode("ascii"), match.end())
+            # always the last section, and most of the file
+            if last[0] == "HitObjects":
+                break
+        if last is not None:
+            self.sections[last[0]] = (last[1], len(content))
+
+        self._metadata: BeatmapMetadata | None = None
+        self._difficulty: BeatmapDifficulty | None = None
+
+    def get_section(self, name: str) -> dict[str, str]:
+        if (bounds := self.sections.get(name)) is None:
+            return {}
 
-    def __init__(self):
-        self._lock = asyncio.Lock()
+        data = {}
+        for line in self.content[bounds[0]:bounds[1]].decode("utf-8", "replace").splitlines():
+            if line.startswith("//") or ":" not in line:
+                continue
+            key, value = line.split(":", 1)
+            data[key.strip()] = value.strip()
+        return data
 
-    async def get_beatmap_file(self, beatmap_id: int) -> bytes | None:
-        async with self._lock:
-            async with ClientSession() as session:
-                async with session.get(f"https://osu.ppy.sh/osu/{beatmap_id}") as resp:
-                    try:
-                        resp.raise_for_status()
-                    except Exception as e:
-                        log.exception(f"Failed to get osu beatmap", exc_info=e)
-                        return
-                    return await resp.read()
+    @property
+    def metadata(self) -> BeatmapMetadata:
+        if self._metadata is None:
+            self._metadata = BeatmapMetadata(self.get_section("Metadata"))
+        return self._metadata
 
+    @property
+    def difficulty(self) -> BeatmapDifficulty:
+        if self._difficulty is None:
+            self._difficulty = BeatmapDifficulty(self.get_section("Difficulty"))
+        return self._difficulty
 
-class BeatmapReader(br.BeatmapReader):
-    __slots__ = ("lines",)
 
-    def __init__(self, lines):
-        super().__init__("")
-        self.lines = lines
+LegacyStats = namedtuple("SimpleStats", ("n_geki", "n300", "n_katu", "n100", "n50", "misses"))
+# GameMode can't be constructed from an int
+GAME_MODES = (rosu.GameMode.Osu, rosu.GameMode.Taiko, rosu.GameMode.Catch, rosu.GameMode.Mania)
 
-    def load_beatmap_data(self):
-        data = {}
-        current_section = None
-        for line in self.lines:
-            line = line[:-1]
-            ascii_line = "".join(filter(lambda char: char.isascii(), line))
-            if line.strip() == "" or line.startswith("//"):
-                continue
-            if current_section is None and ascii_line.startswith("osu file format"):
-                data.update({"version": int(ascii_line[17:].strip())})
-                continue
-            if line.startswith("[") and line.endswith("]"):
-                current_section = line[1:-1]
-                data.update({current_section: {} if current_section in self.key_value_sections else []})
-                continue
-            if current_section is None:
-                continue
-            if current_section in self.key_value_sections:
-                kv = map(str.strip, line.split(":", 1))
-                data[current_section].update({next(kv): next(kv)})
-            else:
-                data[current_section].append(line.strip())
-        return data
 
+class CalculatorCache:
+    """
+    LRU of parsed beatmaps, keyed by beatmap id and the mode they were
+    converted to (None if not converted). The size is counted by the .osu
+    files they were parsed from, which the parsed objects scale with.
+    """
 
-LegacyStats = namedtuple("SimpleStats", ("n_geki", "n300", "n_katu", "n100", "n50", "misses"))
+    __slots__ = ("max_size", "size", "entries")
 
+    def __init__(self, max_size: int):
+        self.max_size: int = max_size
+        self.size: int = 0
+        self.entries: OrderedDict[tuple[int, int | None], BeatmapCalculator] = OrderedDict()
 
-class BeatmapCalculator:
-    __slots__ = ("beatmap", "info", "last_diff", "last_perf", "last_mods", "last_clock_rate", "last_lazer", "last_passed", "beatmap_id")
+    def get(self, beatmap_id: int, mode: int | None, checksum: str | None = None) -> BeatmapCalculator | None:
+        key = (beatmap_id, mode)
+        calc = self.entries.get(key)
+        if calc is None or (checksum is not None and calc.checksum != checksum):
+            return
+
+        self.entries.move_to_end(key)
+        return calc
+
+    def put(self, mode: int | None, calc: BeatmapCalculator):
+        key = (calc.beatmap_id, mode)
+        if (old := self.entries.pop(key, None)) is not None:
+            self.size -= len(old.content)
+            if mode is None:
+                # converted from an older version of the map
+                self.remove_converted(calc.beatmap_id)
+
+        self.entries[key] = calc
+        self.size += len(calc.content)
+        while self.size > self.max_size:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted.content)
 
-    beatmap_file_manager = BeatmapFileManager()
+    def remove_converted(self, beatmap_id: int):
+        for mode in range(len(GAME_MODES)):
+            if (old := self.entries.pop((beatmap_id, mode), None)) is not None:
+                self.size -= len(old.content)
 
-    def __init__(self, beatmap: rosu.Beatmap, info: br.Beatmap, beatmap_id: int):
+
+class BeatmapCalculator:
+    __slots__ = (
+        "beatmap", "info", "last_diff", "last_perf", "last_mods", "last_clock_rate", "last_lazer",
+        "beatmap_id", "content", "checksum", "difficulties"
+    )
+
+    # in megabytes of .osu files
+    CACHE_SIZE = int(os.getenv("BEATMAP_CALC_CACHE_SIZE") or 64)
+    cache = CalculatorCache(CACHE_SIZE * 1024 * 1024)
+    # difficulty attributes kept per calculator
+    MAX_DIFFICULTIES = 16
+
+    def __init__(self, beatmap: rosu.Beatmap, info: BeatmapInfo, beatmap_id: int, content: bytes):
         self.beatmap: rosu.Beatmap = beatmap
-        self.info: br.Beatmap = info  # used by commands for displaying artist information n stuff
+        self.info: BeatmapInfo = info  # used by commands for displaying artist information n stuff
         self.last_diff: None | rosu.DifficultyAttributes = None
         self.last_perf: None | rosu.PerformanceAttributes = None
         self.last_mods: None | int = None
         self.last_clock_rate: None | float = None
         self.last_lazer: None | bool = None
-        self.last_passed: None | bool = None
         self.beatmap_id = beatmap_id
+        self.content: bytes = content
+        self.checksum: str = get_checksum(content)
+        # (mods, clock rate, lazer, passed objects) -> attributes
+        self.difficulties: OrderedDict[tuple[int, float, bool, int | None], rosu.DifficultyAttributes] = OrderedDict()
 
     @classmethod
-    async def from_beatmap_id(cls, beatmap_id: int) -> BeatmapCalculator | None:
-        content = await cls.beatmap_file_manager.get_beatmap_file(beatmap_id)
+    async def from_beatmap_id(
+        cls,
+        file_manager: BeatmapFileManager,
+        beatmap_id: int,
+        checksum: str | None = None
+    ) -> BeatmapCalculator | None:
+        """The returned calculator is shared, use converted() rather than converting its beatmap"""
+        checksum = file_manager.resolve_checksum(beatmap_id, checksum)
+        if (calc := cls.cache.get(beatmap_id, None, checksum)) is not None:
+            return calc
+
+        content = await file_manager.get_beatmap_file(beatmap_id, checksum)
         if content is None or len(content) == 0:
             return None
 
-        info = br.Beatmap(BeatmapReader(content.decode("utf-8").split("\n")))
-        info.load()
-        return cls(rosu.Beatmap(bytes=content), info, beatmap_id)
+        # may have been parsed by someone else while getting the file
+        if (calc := cls.cache.get(beatmap_id, None, checksum)) is not None and calc.content == content:
+            return calc
+
+        calc = cls(rosu.Beatmap(bytes=content), BeatmapInfo(content), beatmap_id, content)
+        cls.cache.put(None, calc)
+        return calc
+
+    def converted(self, mode: int) -> BeatmapCalculator:
+        """Copy of the calculator with the beatmap converted to the mode"""
+        if mode == int(self.beatmap.mode):
+            return self
+
+        if (calc := self.cache.get(self.beatmap_id, mode, self.checksum)) is not None:
+            return calc
+
+        beatmap = rosu.Beatmap(bytes=self.content)
+        beatmap.convert(GAME_MODES[mode])
+        calc = BeatmapCalculator(beatmap, self.info, self.beatmap_id, self.content)
+        self.cache.put(mode, calc)
+        return calc
 
     @staticmethod
     def parse_stats(stats: osu.ScoreDataStatistics) -> LegacyStats:
@@ -170,6 +404,37 @@ class BeatmapCalculator:
             3: lambda s: (300 * (s.n_geki + s.n300) + 200 * s.n_katu + 100 * s.n100 + 50 * s.n50) / (300 * (s.n_geki + s.n300 + s.n_katu + s.n100 + s.n50 + s.misses))
         }[ruleset_id](stats)
 
+    def get_difficulty(
+        self,
+        mods: int,
+        clock_rate: float,
+        lazer: bool = True,
+        passed_objects: int | None = None
+    ) -> rosu.DifficultyAttributes:
+        """Difficulty attributes for the settings, only calculated if they weren't already"""
+        key = (mods, clock_rate, lazer, passed_objects)
+        if (diff := self.difficulties.get(key)) is not None:
+            self.difficulties.move_to_end(key)
+            return diff
+
+        kwargs = {} if passed_objects is None else {"passed_objects": passed_objects}
+        diff = self.difficulties[key] = rosu.Difficulty(
+            mods=mods,
+            clock_rate=clock_rate,
+            lazer=lazer,
+            **kwargs
+        ).calculate(self.beatmap)
+        if len(self.difficulties) > self.MAX_DIFFICULTIES:
+            self.difficulties.popitem(last=False)
+
+        return diff
+
+    def set_last(self, diff: rosu.DifficultyAttributes, mods: int, clock_rate: float, lazer: bool):
+        self.last_diff = diff
+        self.last_mods = mods
+        self.last_clock_rate = clock_rate
+        self.last_lazer = lazer
+
     def calculate_difficulty(self, mods: int, clock_rate: float | None = None) -> rosu.DifficultyAttributes:
         if clock_rate is None:
             clock_rate = 1.0
@@ -177,30 +442,23 @@ class BeatmapCalculator:
                 clock_rate = 1.5
             elif osu.Mods.HalfTime.value & mods:
                 clock_rate = 0.75
-        self.last_diff = rosu.Difficulty(mods=mods, clock_rate=clock_rate).calculate(self.beatmap)
-        self.last_mods = mods
-        self.last_clock_rate = clock_rate
-        return self.last_diff
+        diff = self.get_difficulty(mods, clock_rate)
+        self.set_last(diff, mods, clock_rate, True)
+        return diff
 
     def calculate(self, score: osu.SoloScore) -> tuple[rosu.PerformanceAttributes, LegacyStats]:
         mods, clock_rate, lazer = self.get_score_settings(score)
         perf, stats = self.get_perf(score.statistics, score.max_combo, mods, clock_rate, lazer, score.passed)
-        self.last_perf = perf.calculate(
-            self.beatmap if self.last_mods != mods or self.last_clock_rate != clock_rate or self.last_lazer != lazer or
-            not score.passed or not self.last_passed else self.last_diff
-        )
-        self.last_diff = self.last_perf.difficulty
-        self.last_mods = mods
-        self.last_clock_rate = clock_rate
-        self.last_lazer = lazer
-        self.last_passed = score.passed
+        # a failed score is only worth the part of the map that was played
+        diff = self.get_difficulty(mods, clock_rate, lazer, None if score.passed else sum(stats))
+
+        self.last_perf = perf.calculate(diff)
+        self.set_last(diff, mods, clock_rate, lazer)
         return self.last_perf, stats
 
     def calculate_if_fc(self, score: osu.SoloScore) -> tuple[rosu.PerformanceAttributes, float]:
         mods, clock_rate, lazer = self.get_score_settings(score)
-
-        diff = self.calculate_difficulty(mods, clock_rate) if self.last_diff is None or self.last_mods != mods \
-            or self.last_clock_rate != clock_rate or not score.passed or not self.last_passed else self.last_diff
+        diff = self.get_difficulty(mods, clock_rate, lazer)
 
         stats = self.parse_stats(score.statistics)
         stats = LegacyStats(
@@ -228,10 +486,7 @@ class BeatmapCalculator:
         )
 
         self.last_perf = perf.calculate(diff)
-        self.last_diff = diff
-        self.last_mods = mods
-        self.last_clock_rate = clock_rate
-        self.last_passed = score.passed
+        self.set_last(diff, mods, clock_rate, lazer)
 
         return (
             self.last_perf,
@@ -245,5 +500,6 @@ class BeatmapCalculator:
         return rosu.Performance(
             accuracy=acc*100,
             mods=self.last_mods,
-            clock_rate=self.last_clock_rate
-        ).calculate(self.last_diff)
+            clock_rate=self.last_clock_rate,
+            lazer=self.last_lazer
+        ).calculate(self.get_difficulty(self.last_mods, self.last_clock_rate, self.last_lazer))
@@ -1,27 +1,25 @@
 from ...context import MessageContext
 from ..base import CommandArg
-from ...bot import BotMeta
+from ...bot import BotMeta, ctx_filter
 from .client import OsuClientBot
 
-import asyncio
 import random
 from osu import BeatmapsetSearchFilter, BeatmapsetSearchSort, GameModeInt
 
 
 class MapGuessHelper:
-    __slots__ = ("loop", "answers")
+    __slots__ = ("call_later", "answers")
 
-    def __init__(self, loop):
-        self.loop = loop
+    def __init__(self, call_later):
+        self.call_later = call_later
         self.answers = {}
 
     def new(self, channel, beatmapset, timeout_callback, money, i=None) -> str:
         async def timeout():
-            await asyncio.sleep(30)
             answer = self.complete(channel, cancel=False)
             await timeout_callback(answer)
 
-        task = self.loop.create_task(timeout())
+        timer = self.call_later(30, timeout)
 
         top_diff = sorted(beatmapset.beatmaps, key=lambda b: b.difficulty_rating)[-1]
         attrs = [beatmapset.artist, beatmapset.title, top_diff.version, beatmapset.creator]
@@ -30,7 +28,7 @@ class MapGuessHelper:
         original = attrs[mystery_attr]
         attrs[mystery_attr] = " ".join(map(lambda s: "?"*len(s), original.split(" ")))
 
-        self.answers[channel] = (original, task, money)
+        self.answers[channel] = (original, timer, money)
         return ("Fill in the blank (top difficulty): {} - {} [{}] (%.2f*) mapset by {}" % top_diff.difficulty_rating).format(*attrs)
 
     def check(self, channel, guess):
@@ -55,8 +53,9 @@ class OsuGuessBot(OsuClientBot, metaclass=BotMeta):
     command_manager = OsuClientBot.command_manager
 
     def __init__(self):
-        self.osu_guess_helper = MapGuessHelper(self.loop)
+        self.osu_guess_helper = MapGuessHelper(self.call_later)
 
+    @ctx_filter(lambda self, ctx: self.osu_guess_helper.in_progress(ctx.channel))
     async def on_message(self, ctx: MessageContext):
         if (money := self.osu_guess_helper.check(ctx.channel, ctx.message)) != 0:
             await self.send_message(
@@ -1,12 +1,12 @@
 from ..base import Cooldown, CommandArg
 from ...context import JoinContext
-from .diff_pp_calc import BeatmapCalculator
+from .diff_pp_calc import BeatmapCalculator, BeatmapFileManager
 from ...util import format_date
 from ...bot import BotMeta
 from .client import OsuClientBot
 
 from osu import Mod, SoloScore, GameModeStr, GameModeInt, Mods
-from aiohttp import client_exceptions, ClientSession
+from aiohttp import client_exceptions
 from datetime import datetime
 import logging
 import json
@@ -25,13 +25,14 @@ log = logging.getLogger(__name__)
 
 
 class OsuBot(OsuClientBot, metaclass=BotMeta):
-    __slots__ = ("osu_user_id_cache", "recent_score_cache", "max_medals")
+    __slots__ = ("osu_user_id_cache", "recent_score_cache", "max_medals", "beatmap_file_manager")
 
     command_manager = OsuClientBot.command_manager
 
     def __init__(self):
         self.osu_user_id_cache = {}
         self.recent_score_cache = {}
+        self.beatmap_file_manager = BeatmapFileManager(self.http)
 
     async def on_setup(self, ctx):
         self.max_medals = await self.get_max_medals()
@@ -41,13 +42,16 @@ class OsuBot(OsuClientBot, metaclass=BotMeta):
 
     async def get_max_medals(self):
         try:
-            async with ClientSession() as session:
-                async with session.get("https://inex.osekai.net/api/medals/get_all") as resp:
-                    return len(json.loads(await resp.read()).get("content", []))
+            async with self.http.get("https://inex.osekai.net/api/medals/get_all") as resp:
+                return len(json.loads(await resp.read()).get("content", []))
         except Exception as exc:
             log.exception("Unable to fetch total medals from osekai", exc_info=exc)
             return 0
 
+    @staticmethod
+    def get_beatmap_checksum(score: SoloScore) -> str | None:
+        return score.beatmap.checksum if score.beatmap is not None else None
+
     async def get_user_with_feedback(self, ctx, username: str):
         try:
             return await self.osu_client.get_user(user="@"+username)
@@ -135,7 +139,7 @@ class OsuBot(OsuClientBot, metaclass=BotMeta):
         score_format = prefix + ":{passed} {artist} - {title} [{diff}]{mods} ({mapper}, {star_rating}*) " \
                                 "{acc}% {combo}/{max_combo} | ({hit_counts}) | {pp}{if_fc_pp} | {time_ago} ago"
 
-        calc = await BeatmapCalculator.from_beatmap_id(score.beatmap_id)
+        calc = await self.get_beatmap_calc(score.beatmap_id, self.get_beatmap_checksum(score))
         perf, fc_perf, fc_acc, hits = self.get_score_attrs(calc, score)
 
         pp = score.pp or perf.pp
@@ -164,7 +168,7 @@ class OsuBot(OsuClientBot, metaclass=BotMeta):
         score_format = "{artist} - {title} [{diff}]{mods} ({sr}*) {acc}% ({hit_counts}): {pp}pp{fc_pp} | {time_ago} ago"
         message = ""
         calcs: tuple[BeatmapCalculator] = await asyncio.gather(
-            *(BeatmapCalculator.from_beatmap_id(score.beatmap_id) for score in scores)
+            *(self.get_beatmap_calc(score.beatmap_id, self.get_beatmap_checksum(score)) for score in scores)
         )
         for calc, score in zip(calcs, scores):
             perf, fc_perf, fc_acc, hits = self.get_score_attrs(calc, score)
@@ -196,6 +200,9 @@ class OsuBot(OsuClientBot, metaclass=BotMeta):
             if osu_user_id == user_id:
                 return username
 
+    def get_beatmap_calc(self, beatmap_id: int, checksum: str | None = None):
+        return BeatmapCalculator.from_beatmap_id(self.beatmap_file_manager, beatmap_id, checksum)
+
     def get_map_cache(self, ctx) -> BeatmapCalculator | None:
         if len(self.recent_score_cache[ctx.channel]) == 0:
             return
@@ -205,13 +212,23 @@ class OsuBot(OsuClientBot, metaclass=BotMeta):
             return
         return tuple(self.recent_score_cache[ctx.channel].values())[-1]
 
-    def add_recent_map(self, ctx, sent_message, bm_calc):
-        msg = " ".join(sent_message)
-        if msg in self.recent_score_cache[ctx.channel]:
-            del self.recent_score_cache[ctx.channel][msg]
-        self.recent_score_cache[ctx.channel].update({msg: bm_calc})
-        while len(self.recent_score_cache[ctx.channel]) > 10:
-            del self.recent_score_cache[ctx.channel][next(iter(self.recent_score_cache[ctx.channel].keys()))]
+    def add_recent_map(self, ctx, sent_message: asyncio.Future | None, bm_calc):
+        if sent_message is None:
+            return
+
+        def add(future):
+            if future.cancelled() or future.exception() is not None:
+                return
+
+            msg = " ".join(future.result())
+            if msg in self.recent_score_cache[ctx.channel]:
+                del self.recent_score_cache[ctx.channel][msg]
+            self.recent_score_cache[ctx.channel].update({msg: bm_calc})
+            while len(self.recent_score_cache[ctx.channel]) > 10:
+                del self.recent_score_cache[ctx.channel][next(iter(self.recent_score_cache[ctx.channel].keys()))]
+
+        # can only be replied to once it's actually sent
+        sent_message.add_done_callback(add)
 
     def parse_beatmap_link(self, link: str):
         parts = link.lower().split("/")
@@ -248,7 +265,7 @@ class OsuBot(OsuClientBot, metaclass=BotMeta):
             await self.send_message(ctx.channel, "Must specify a beatmap id, not a beatmapset.")
             return
 
-        calc = await BeatmapCalculator.from_beatmap_id(id)
+        calc = await self.get_beatmap_calc(id)
         if calc is None:
             await self.send_message(ctx.channel, "Failed to get beatmap from the provided link/id.")
             return
@@ -316,7 +333,7 @@ class OsuBot(OsuClientBot, metaclass=BotMeta):
 
         score = scores[0 if not best else index]
         msg, calc = await self.get_score_message(score)
-        sent_message = await self.send_message(ctx.channel, msg)
+        sent_message = await self.send_message(ctx.channel, msg, coalesce=False)
         self.add_recent_map(ctx, sent_message, calc)
 
     @command_manager.command(
@@ -356,8 +373,7 @@ class OsuBot(OsuClientBot, metaclass=BotMeta):
             return
         username = self.osu_username_from_id(user_id)
 
-        if mode != int(calc.beatmap.mode):
-            calc.beatmap.convert(rosu.GameMode(mode))
+        calc = calc.converted(mode)
 
         mode = GameModeStr[GameModeInt(mode).name].value
 
@@ -390,7 +406,7 @@ class OsuBot(OsuClientBot, metaclass=BotMeta):
                 "pp": f"{round(perf.pp, 2)}pp",
                 "time_ago": format_date(score.ended_at)
             })
-        sent_message = await self.send_message(ctx.channel, message)
+        sent_message = await self.send_message(ctx.channel, message, coalesce=False)
         self.add_recent_map(ctx, sent_message, calc)
 
     async def get_beatmap_calc_from_arg_or_cache(self, ctx, args):
@@ -411,7 +427,7 @@ class OsuBot(OsuClientBot, metaclass=BotMeta):
             f"({calc.info.metadata.creator}, {round(diff.stars, 2)}*) "
             f"https://osu.ppy.sh/b/{calc.beatmap_id} | https://preview.tryz.id.vn/?b={calc.beatmap_id}"
         )
-        sent_message = await self.send_message(ctx.channel, f"@{ctx.user.display_name} {text}")
+        sent_message = await self.send_message(ctx.channel, f"@{ctx.user.display_name} {text}", coalesce=False)
         self.add_recent_map(ctx, sent_message, calc)
 
     async def _send_beatmapset(self, ctx, beatmapset):
@@ -440,7 +456,7 @@ class OsuBot(OsuClientBot, metaclass=BotMeta):
                 )
 
             if is_bm:
-                await self._send_beatmap(ctx, await BeatmapCalculator.from_beatmap_id(beatmap.id))
+                await self._send_beatmap(ctx, await self.get_beatmap_calc(beatmap.id, beatmap.checksum))
                 return
 
             await self._send_beatmapset(ctx, beatmap)
@@ -600,7 +616,7 @@ class OsuBot(OsuClientBot, metaclass=BotMeta):
                 score, f"Top {index + 1}{' recent' if recent_tops else ''} score for {username}"
             )
 
-        sent_message = await self.send_message(ctx.channel, message)
+        sent_message = await self.send_message(ctx.channel, message, coalesce=False)
         if calc is not None:
             self.add_recent_map(ctx, sent_message, calc)
 
@@ -803,7 +819,7 @@ class OsuBot(OsuClientBot, metaclass=BotMeta):
         score.user = await self.osu_client.get_user(score.user_id)
 
         score_msg, bm_calc = await self.get_score_message(score, "Random recent score from {username}")
-        msg = await self.send_message(ctx.channel, score_msg)
+        msg = await self.send_message(ctx.channel, score_msg, coalesce=False)
 
         self.add_recent_map(ctx, msg, bm_calc)
 
@@ -822,9 +838,8 @@ class OsuBot(OsuClientBot, metaclass=BotMeta):
             return
         username = self.osu_username_from_id(user_id)
 
-        async with ClientSession() as session:
-            async with session.get(f"https://api.kirino.sh/inspector/scores/user/{user_id}?approved=1,2,4") as resp:
-                data = await resp.json()
+        async with self.http.get(f"https://api.kirino.sh/inspector/scores/user/{user_id}?approved=1,2,4") as resp:
+            data = await resp.json()
 
         def without_cl(score_mods):
             return [mod for mod in score_mods if mod["acronym"] != "CL"]
@@ -844,7 +859,7 @@ class OsuBot(OsuClientBot, metaclass=BotMeta):
 
         score = random.choice(data)
 
-        calc = await BeatmapCalculator.from_beatmap_id(score["beatmap"]["beatmap_id"])
+        calc = await self.get_beatmap_calc(score["beatmap"]["beatmap_id"])
 
         score_format = "Random score for {username}: {artist} - {title} [{diff}]{mods} ({mapper}, {star_rating}*) " \
                        "{acc}% {combo}/{max_combo} | ({hit_counts}) | {pp}pp | {time_ago} ago"
@@ -866,7 +881,8 @@ class OsuBot(OsuClientBot, metaclass=BotMeta):
                 ),
                 pp=round(float(score["pp"]), 2),
                 time_ago=format_date(datetime.fromisoformat(score["date_played"]))
-            )
+            ),
+            coalesce=False
         )
 
         self.add_recent_map(ctx, msg, calc)
@@ -1,41 +1,142 @@
 from .base import CommandBot, CommandArg
-from ..context import MessageContext, JoinContext
+from ..context import MessageContext, JoinContext, PartContext
 from ..database import UserReminder
-from ..util import format_time_length
+from ..util import format_time_length, Timer
 from ..bot import BotMeta
 
+from collections import defaultdict
 from datetime import datetime, timedelta, timezone
+from heapq import heappush, heappop
 from pytz import timezone as pytz_timezone
 from time import time
+import logging
+
+
+log = logging.getLogger(__name__)
 
 
 class ReminderBot(CommandBot, metaclass=BotMeta):
+    """
+    Reminders due within HORIZON seconds are kept in a heap, with a single timer
+    for whichever comes first: the next reminder or loading the next window.
+    """
+
+    __slots__ = (
+        "reminders", "reminder_ids", "loaded_until", "loading_until", "waiting", "joined_channels", "reminder_timer"
+    )
+
     command_manager = CommandBot.command_manager
 
+    HORIZON = 60 * 60
+    PAGE_SIZE = 500
+    RETRY_WAIT = 30
+
     def __init__(self):
-        self.old_reminders: list[UserReminder] = None  # type: ignore
+        # (remind_at, id, reminder)
+        self.reminders: list[tuple[int, int, UserReminder]] = []
+        # ids in the heap, since a new reminder can also be in the window being loaded
+        self.reminder_ids: set[int] = set()
+        # everything due before this is in the heap (or was already sent)
+        self.loaded_until: int = 0
+        # end of the window being loaded
+        self.loading_until: int = 0
+        # channel -> due reminders that are waiting on the channel to be joined
+        self.waiting: defaultdict[str, list[UserReminder]] = defaultdict(list)
+        self.joined_channels: set[str] = set()
+        self.reminder_timer: Timer | None = None
 
     async def on_setup(self, ctx):
-        self.old_reminders = await self.db.get_reminders()
+        await self.load_reminders(round(time()) + self.HORIZON)
+        self.schedule_reminders()
 
     async def on_join(self, ctx: JoinContext):
-        reminders = [reminder for reminder in self.old_reminders if reminder.channel.user.username == ctx.channel]
-        for reminder in reminders:
-            self.set_reminder_event(reminder)
-            self.old_reminders.remove(reminder)
+        self.joined_channels.add(ctx.channel)
+        if (reminders := self.waiting.pop(ctx.channel, None)) is not None:
+            await self.send_reminders(reminders)
+
+    async def on_part(self, ctx: PartContext):
+        self.joined_channels.discard(ctx.channel)
+
+    async def load_reminders(self, until: int):
+        # set first, so reminders made while loading aren't left out if the query already ran
+        self.loading_until = until
+        after = (self.loaded_until, 0)
+        while True:
+            reminders = await self.db.get_reminders(after, until, self.PAGE_SIZE)
+            for reminder in reminders:
+                self.push_reminder(reminder)
+
+            if len(reminders) < self.PAGE_SIZE:
+                break
+            after = (reminders[-1].remind_at, reminders[-1].id)
+
+        self.loaded_until = until
+
+    def push_reminder(self, reminder: UserReminder):
+        if reminder.id in self.reminder_ids:
+            return
 
-    async def send_reminder_msg(self, reminder: UserReminder):
-        user = await self.db.get_user(reminder.user.id, reminder.user.username)
-        channel = await self.db.get_channel_from_user_id(reminder.channel.user.id)
-        await self.send_message(
-            channel.user.username,
-            f"@{user.username} DinkDonk Reminder! {reminder.message}"
-        )
-        await self.db.finish_reminder(reminder.id)
+        self.reminder_ids.add(reminder.id)
+        heappush(self.reminders, (reminder.remind_at, reminder.id, reminder))
 
-    def set_reminder_event(self, reminder: UserReminder):
-        length = round(max(0.0, (reminder.remind_at - time())))
-        self.call_later(length, self.send_reminder_msg, reminder)
+    def pop_reminder(self) -> UserReminder:
+        reminder = heappop(self.reminders)[2]
+        self.reminder_ids.discard(reminder.id)
+        return reminder
+
+    def add_reminder(self, reminder: UserReminder):
+        # otherwise it gets picked up with its window
+        if reminder.remind_at >= max(self.loaded_until, self.loading_until):
+            return
+
+        self.push_reminder(reminder)
+        if self.reminders[0][2] is reminder:
+            self.schedule_reminders()
+
+    def schedule_reminders(self):
+        if self.reminder_timer is not None:
+            self.reminder_timer.cancel()
+
+        next_at = self.loaded_until if len(self.reminders) == 0 else min(self.reminders[0][0], self.loaded_until)
+        self.reminder_timer = self.call_later(max(0.0, next_at - time()), self.on_reminder_timer)
+
+    async def on_reminder_timer(self):
+        # this timer is running now, so it shouldn't be cancelled if something gets rescheduled
+        self.reminder_timer = None
+
+        try:
+            now = time()
+            if now >= self.loaded_until:
+                try:
+                    await self.load_reminders(round(now) + self.HORIZON)
+                except Exception as exc:
+                    log.exception("Failed to load reminders", exc_info=exc)
+                    self.reminder_timer = self.call_later(self.RETRY_WAIT, self.on_reminder_timer)
+
+            due = []
+            while len(self.reminders) > 0 and self.reminders[0][0] <= now:
+                due.append(self.pop_reminder())
+
+            ready = []
+            for reminder in due:
+                if (channel := reminder.channel.user.username) in self.joined_channels:
+                    ready.append(reminder)
+                else:
+                    self.waiting[channel].append(reminder)
+
+            if len(ready) > 0:
+                await self.send_reminders(ready)
+        finally:
+            if self.reminder_timer is None:
+                self.schedule_reminders()
+
+    async def send_reminders(self, reminders: list[UserReminder]):
+        for reminder in reminders:
+            await self.send_message(
+                reminder.channel.user.username,
+                f"@{reminder.user.username} DinkDonk Reminder! {reminder.message}"
+            )
+        await self.db.finish_reminders([reminder.id for reminder in reminders])
 
     async def time_text_to_timedelta(self, ctx: MessageContext, text: str) -> timedelta | None:
         time_multipliers = {
@@ -118,9 +219,10 @@ class ReminderBot(CommandBot, metaclass=BotMeta):
             ctx.sending_user,
             timestamp,
             " ".join(args[1:]),
-            ctx.room_id
+            ctx.room_id,
+            ctx.channel
         )
-        self.set_reminder_event(reminder)
+        self.add_reminder(reminder)
 
         await self.send_message(
             ctx.channel,
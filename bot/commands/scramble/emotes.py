@@ -1,8 +1,9 @@
 import asyncio
 import logging
-from aiohttp import client_exceptions, ClientSession
+from aiohttp import client_exceptions
 
 from ...twitch_api import TwitchAPIHelper
+from ...http_client import HTTPClient
 
 
 log = logging.getLogger(__name__)
@@ -60,16 +61,16 @@ class Path:
 
 
 class HTTPHandler:
-    def __init__(self, twitch_client: TwitchAPIHelper):
+    def __init__(self, http: HTTPClient, twitch_client: TwitchAPIHelper):
+        self.http: HTTPClient = http
         self.twitch_client: TwitchAPIHelper = twitch_client
         self.user_id_cache: dict[str, int] = {}
 
     async def make_request(self, method, url, return_on_error=None, **kwargs):
         try:
-            async with ClientSession() as session:
-                async with session.request(method, url, **kwargs) as resp:
-                    return await resp.json()
-        except client_exceptions.ClientError as exc:
+            async with self.http.request(method, url, **kwargs) as resp:
+                return await resp.json()
+        except (client_exceptions.ClientError, asyncio.TimeoutError) as exc:
             log.exception(exc)
             return return_on_error
 
@@ -130,8 +131,8 @@ def catch_error(on_fail, require_channel=False):
 
 
 class EmoteRequester:
-    def __init__(self, twitch_client: TwitchAPIHelper):
-        self.http: HTTPHandler = HTTPHandler(twitch_client)
+    def __init__(self, http: HTTPClient, twitch_client: TwitchAPIHelper):
+        self.http: HTTPHandler = HTTPHandler(http, twitch_client)
 
     @catch_error(lambda: [], True)
     async def get_channel_emotes(self, channel):
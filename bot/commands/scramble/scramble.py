@@ -1,6 +1,6 @@
 from ..static_data import StaticDataBot
 from .emotes import EmoteRequester
-from ...bot import BotMeta
+from ...bot import BotMeta, ctx_filter
 from ...context import MessageContext, JoinContext
 
 import random
@@ -181,7 +181,7 @@ class ScrambleBot(StaticDataBot, metaclass=BotMeta):
     command_manager = StaticDataBot.command_manager
 
     def __init__(self):
-        self.emote_requester = EmoteRequester(self.twitch_client)
+        self.emote_requester = EmoteRequester(self.http, self.twitch_client)
         self.emotes = {}
 
         self.scrambles = {
@@ -196,6 +196,7 @@ class ScrambleBot(StaticDataBot, metaclass=BotMeta):
         }
         self.scramble_manager = ScrambleManager(self.scrambles)
 
+    @ctx_filter(lambda self, ctx: any(scramble.in_progress(ctx.channel) for scramble in self.scrambles.values()))
     async def on_message(self, ctx: MessageContext):
         for scramble_type, scramble in self.scrambles.items():
             if scramble.in_progress(ctx.channel):
@@ -11,13 +11,16 @@ class ServerMessageHandlerBot(CommandBot, metaclass=BotMeta):
 
         for i, channel in enumerate(self.channels):
             if channel.id == data["channel_id"]:
+                self.unindex_channel(channel)
+
                 if not new_channel.is_enabled:
                     await self.part(channel.user.username)
-                    self.offline_channels.pop(channel.user.username, None)
+                    await self.unwatch_stream(channel)
                     self.channels.pop(i)
                     return
 
                 self.channels[i] = new_channel
+                self.index_channel(new_channel)
 
                 if new_channel.user.username != channel.user.username:
                     await self.part(channel.user.username)
@@ -25,11 +28,13 @@ class ServerMessageHandlerBot(CommandBot, metaclass=BotMeta):
                     offline_value = self.offline_channels.pop(channel.user.username, None)
                     if offline_value is not None:
                         self.offline_channels[new_channel.user.username] = offline_value
+                        if self.eventsub is not None:
+                            await self.eventsub.subscribe(new_channel.user.id, new_channel.user.username)
 
                 if new_channel.is_offline_only and not channel.is_offline_only:
-                    self.offline_channels[new_channel.user.username] = False
+                    await self.watch_stream(new_channel)
                 elif not new_channel.is_offline_only and channel.is_offline_only:
-                    self.offline_channels.pop(new_channel.user.username, None)
+                    await self.unwatch_stream(new_channel)
 
                 return
 
@@ -38,6 +43,9 @@ class ServerMessageHandlerBot(CommandBot, metaclass=BotMeta):
 
         # new channel
         self.channels.append(new_channel)
+        self.index_channel(new_channel)
+        if new_channel.is_offline_only:
+            await self.watch_stream(new_channel)
         await self.join(new_channel.user.username)
 
     HANDLERS = [on_refresh_channel]
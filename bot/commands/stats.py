@@ -0,0 +1,39 @@
+from .base import CommandBot, Cooldown
+from ..bot import BotMeta
+
+import os
+
+
+class StatsBot(CommandBot, metaclass=BotMeta):
+    command_manager = CommandBot.command_manager
+
+    # usernames allowed to use admin commands
+    ADMIN_USERS = set(filter(None, map(str.strip, os.getenv("ADMIN_USERS", "").lower().split(","))))
+
+    @command_manager.command(
+        "stats",
+        "Shows how the bot is performing (admin only)",
+        cooldown=Cooldown(5, 0)
+    )
+    async def stats(self, ctx):
+        if ctx.sending_user not in self.ADMIN_USERS:
+            return
+
+        queue_stats = self.manager.ctx_queue.stats().values()
+        db_stats = self.db.get_stats()
+        watchdog_stats = self.watchdog.stats()
+
+        parts = [
+            f"queue: {sum(stats['depth'] for stats in queue_stats)} waiting, "
+            f"{sum(stats['dropped'] for stats in queue_stats)} dropped, "
+            f"max {max((stats['max_latency'] for stats in queue_stats), default=0) * 1000:.0f}ms",
+            f"loop: {watchdog_stats['stalls']} stalls, max lag {watchdog_stats['max_lag'] * 1000:.0f}ms",
+            f"db: {db_stats['pool_size'] - db_stats['pool_available']}/{db_stats['pool_size']} in use, "
+            f"avg wait {db_stats['avg_wait'] * 1000:.1f}ms",
+            "slowest: " + ", ".join(
+                f"{name} {stats.duration.avg * 1000:.0f}ms avg/{stats.duration.max * 1000:.0f}ms max "
+                f"({stats.calls} calls, {stats.errors} errors)"
+                for name, stats in self.metrics.get_slowest(3)
+            )
+        ]
+        await self.send_message(ctx.channel, f"@{ctx.user.display_name} " + " | ".join(parts))
@@ -1,8 +1,8 @@
 from .base import CommandBot, CommandArg
 from ..context import MessageContext
-from ..bot import BotMeta
+from ..bot import BotMeta, ctx_filter
+from ..http_client import HTTPClient
 
-import requests
 import random
 import html
 import logging
@@ -25,13 +25,15 @@ class TriviaHelper:
         "hard": "pepeMeltdown"
     }
 
-    def __init__(self):
+    def __init__(self, http: HTTPClient):
+        self.http: HTTPClient = http
         self.guessed_answers = []
         self.future = None
         self.difficulty = None
         self.answer = None
 
-    def generate_question(self, category=None):
+    async def generate_question(self, category=None):
+        # marks it as in progress while the question is fetched
         self.answer = "temp"
 
         params = {
@@ -41,17 +43,19 @@ class TriviaHelper:
         if category:
             params["category"] = category
         try:
-            resp = requests.get("https://opentdb.com/api.php", params=params)
+            async with self.http.get("https://opentdb.com/api.php", params=params) as resp:
+                if resp.status != 200:
+                    self.answer = None
+                    return
+
+                data = await resp.json()
         except Exception as e:
             log.exception(e)
             self.answer = None
             return
-        if resp.status_code != 200:
-            self.answer = None
-            return
 
         try:
-            results = resp.json()['results'][0]
+            results = data['results'][0]
         except IndexError:
             self.answer = None
             return
@@ -67,6 +71,9 @@ class TriviaHelper:
                f"Answers: {answer_string}"
 
     def check_guess(self, ctx, guess):
+        # question is still being fetched
+        if self.difficulty is None:
+            return
         if guess in self.guessed_answers:
             return
         self.guessed_answers.append(guess)
@@ -102,6 +109,7 @@ class TriviaBot(CommandBot, metaclass=BotMeta):
     def __init__(self):
         self.trivia_helpers = {}
 
+    @ctx_filter(lambda self, ctx: (helper := self.trivia_helpers.get(ctx.channel)) is not None and helper.is_in_progress)
     async def on_message(self, ctx: MessageContext):
         if not self.trivia_helpers[ctx.channel].is_in_progress:
             return
@@ -116,7 +124,7 @@ class TriviaBot(CommandBot, metaclass=BotMeta):
             return
 
     async def on_join(self, ctx: MessageContext):
-        self.trivia_helpers[ctx.channel] = TriviaHelper()
+        self.trivia_helpers[ctx.channel] = TriviaHelper(self.http)
 
     @command_manager.command(
         "trivia",
@@ -130,7 +138,7 @@ class TriviaBot(CommandBot, metaclass=BotMeta):
             return
 
         args = ctx.get_args("ascii")
-        question = self.trivia_helpers[ctx.channel].generate_question(args[0] if len(args) > 0 else None)
+        question = await self.trivia_helpers[ctx.channel].generate_question(args[0] if len(args) > 0 else None)
         if question is None:
             return await self.send_message(ctx.channel, "An error occurred when attempting to fetch the question...")
         await self.send_message(ctx.channel, question)
@@ -1,5 +1,8 @@
+from __future__ import annotations
+
 from enum import Enum
 from datetime import datetime
+from time import time
 import pytz
 
 from .util import parse_irc_string
@@ -14,42 +17,71 @@ class ContextType(Enum):
     CONNECTED = "376"
     RECONNECT = "RECONNECT"
     SETUP = "custom-ctx-setup"
-    UPDATE = "custom-ctx-update"
     SERVER_MSG = "custom-ctx-server-msg"
+    STREAM_STATUS = "custom-ctx-stream-status"
 
 
 def parse_tags_string(string):
     return dict(map(lambda item: (item[:(i := item.index("="))], item[i+1:]), string.split(";")))
 
 
-def get_contexts(msg):
-    for string in msg.split("\r\n"):
-        data = string.split()
+def get_tag(tags, key, default=None):
+    """Finds a single tag value in the raw tags string without parsing the rest of it"""
+    if tags is None:
+        return default
+
+    # values can't contain an unescaped semicolon, so every one of them starts a new tag
+    prefix = key + "="
+    if tags.startswith(prefix):
+        i = len(prefix)
+    else:
+        i = tags.find(";" + prefix)
+        if i == -1:
+            return default
+        i += len(prefix) + 1
+
+    end = tags.find(";", i)
+    return tags[i:] if end == -1 else tags[i:end]
 
-        if len(data) < 3:
-            continue
 
+def get_contexts(msg):
+    for string in msg.split("\r\n"):
         tags = None
-        if data[0].startswith("@"):
-            tags = parse_tags_string(data[0][1:])
+        i = 0
+        if string.startswith("@"):
+            i = string.find(" ")
+            if i == -1:
+                continue
+            tags = string[1:i]
+            i += 1
 
-        offset = 1 if tags is not None else 0
+        end = string.find(" ", i)
+        if end == -1:
+            continue
+        source = string[i:end]
 
-        source = data[0 + offset]
+        i = end + 1
+        end = string.find(" ", i)
+        if end == -1:
+            continue
+        msg_type = string[i:end]
 
         try:
-            message_type = ContextType(data[1 + offset])
+            message_type = ContextType(msg_type)
         except ValueError:
-            yield UnknownContext(source, data[1 + offset])
+            yield UnknownContext(source, msg_type)
             continue
 
-        channel = data[2 + offset][1:]
+        i = end + 1
+        end = string.find(" ", i)
+        channel = string[i+1:] if end == -1 else string[i+1:end]
+
         if message_type == ContextType.PRIVMSG:
-            message = " ".join(data[3 + offset:])[1:]
-            sending_user = source.split("!")[0][1:]
+            message = "" if end == -1 else string[end+2:].rstrip()
+            sending_user = source[1:source.find("!")]
             action = False
             if message.startswith("\x01"):
-                message = message[7:-1]
+                message = message[8:-1]
                 action = True
             yield MessageContext(sending_user, channel, message, tags, source, action)
         elif message_type == ContextType.JOIN:
@@ -64,6 +96,30 @@ def get_contexts(msg):
             yield UnknownContext(source, message_type)
 
 
+class TagProperty:
+    """Reads and converts a tag from the raw tags string of the context when accessed"""
+
+    __slots__ = ("key", "convert", "default")
+
+    def __init__(self, key, convert=None, default=None):
+        self.key: str = key
+        self.convert = convert
+        self.default = default
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+
+        value = get_tag(obj.raw_tags, self.key)
+        if value is None:
+            return self.default
+        return value if self.convert is None else self.convert(value)
+
+
+def int_bool(value):
+    return bool(int(value))
+
+
 class JoinContext:
     __slots__ = (
         "channel", "source",
@@ -86,34 +142,55 @@ class PartContext:
 
 class MessageContext:
     __slots__ = (
-        "tags", "source", "message_type", "channel", "message", "user", "action", "time_created",
-        "emotes", "first_msg", "flags", "id", "returning_chatter", "room_id", "tmi_sent_ts",
-        "turbo", "user_id", "user_type", "sending_user", "reply"
+        "raw_tags", "source", "channel", "message", "action", "created_at", "sending_user", "_user", "_reply"
     )
     type = ContextType.PRIVMSG
 
+    emotes = TagProperty("emotes", default=[])
+    first_msg = TagProperty("first-msg", int_bool, False)
+    flags = TagProperty("flags", default=[])
+    id = TagProperty("id")
+    returning_chatter = TagProperty("returning-chatter", int_bool, False)
+    room_id = TagProperty("room-id", int, 0)
+    tmi_sent_ts = TagProperty("tmi-sent-ts", int_bool, False)
+    turbo = TagProperty("turbo", int_bool, False)
+    user_id = TagProperty("user-id", int, -1)
+    user_type = TagProperty("user-type")
+
     def __init__(self, sending_user="", channel="", message="", tags=None, source=None, action=False):
-        self.user: UserStateContext | str = UserStateContext(source, channel, tags) if tags is not None else sending_user
+        self.raw_tags: str | None = tags
         self.sending_user: str = sending_user
         self.channel: str = channel
         self.message: str = message
         self.source: str = source
         self.action: bool = action
-        self.time_created: datetime = datetime.now().replace(tzinfo=pytz.UTC)
-
-        if tags is None:
-            return
-        self.emotes = tags.get("emotes", [])
-        self.first_msg = bool(int(tags.get("first-msg", 0)))
-        self.flags = tags.get("flags", [])
-        self.id = tags.get("id", None)
-        self.returning_chatter = bool(int(tags.get("returning-chatter", 0)))
-        self.room_id = int(tags.get("room-id", 0))
-        self.tmi_sent_ts = bool(int(tags.get("tmi-sent-ts", 0)))
-        self.turbo = bool(int(tags.get("turbo", 0)))
-        self.user_id = int(tags.get("user-id", -1))
-        self.user_type = tags.get("user-type", None)
-        self.reply = ReplyContext(tags) if tags.get("reply-parent-msg-id") else None
+        self.created_at: float = time()
+
+        self._user = None
+        self._reply = None
+
+    @property
+    def tags(self) -> dict[str, str] | None:
+        return None if self.raw_tags is None else parse_tags_string(self.raw_tags)
+
+    @property
+    def time_created(self) -> datetime:
+        return datetime.fromtimestamp(self.created_at, pytz.UTC)
+
+    @property
+    def user(self) -> UserStateContext | str:
+        if self._user is None:
+            self._user = self.sending_user if self.raw_tags is None else \
+                UserStateContext(self.source, self.channel, self.raw_tags)
+        return self._user
+
+    @property
+    def reply(self) -> ReplyContext | None:
+        if self._reply is None:
+            if get_tag(self.raw_tags, "reply-parent-msg-id") is None:
+                return None
+            self._reply = ReplyContext(self.raw_tags)
+        return self._reply
 
     def get_args(self, char_acceptance="unicode"):
         if char_acceptance.lower() == "ascii":
@@ -135,70 +212,85 @@ class MessageContext:
 
 
 class ReplyContext:
-    __slots__ = (
-        "display_name", "user_login", "user_id", "msg_body", "msg_id"
-    )
+    __slots__ = ("raw_tags",)
+
+    display_name = TagProperty("reply-parent-display-name", parse_irc_string, "")
+    user_login = TagProperty("reply-parent-user-login")
+    user_id = TagProperty("reply-parent-user-id")
+    msg_body = TagProperty("reply-parent-msg-body", parse_irc_string, "")
+    msg_id = TagProperty("reply-parent-msg-id")
 
     def __init__(self, tags):
-        self.display_name = parse_irc_string(tags.get("reply-parent-display-name", ""))
-        self.user_login = tags.get("reply-parent-user-login")
-        self.user_id = tags.get("reply-parent-user-id")
-        self.msg_body = parse_irc_string(tags.get("reply-parent-msg-body", ""))
-        self.msg_id = tags.get("reply-parent-msg-id")
+        self.raw_tags: str = tags
 
 
 class RoomStateContext:
-    __slots__ = (
-        "source", "channel", "emote_only", "followers_only", "r9k", "room_id",
-        "slow", "subs_only"
-    )
+    __slots__ = ("source", "channel", "raw_tags")
     type = ContextType.ROOMSTATE
 
+    emote_only = TagProperty("emote-only", int_bool, False)
+    followers_only = TagProperty("followers-only", int_bool, False)
+    r9k = TagProperty("r9k", int_bool, False)
+    room_id = TagProperty("room-id")
+    slow = TagProperty("slow", int_bool, False)
+    subs_only = TagProperty("subs-only", int_bool, False)
+
     def __init__(self, source, channel, tags):
         self.source = source
         self.channel = channel
-        if tags is None:
-            return
-        self.emote_only = bool(int(tags.get("emote-only", 0)))
-        self.followers_only = bool(int(tags.get("followers-only", 0)))
-        self.r9k = bool(int(tags.get("r9k", 0)))
-        self.room_id = tags.get("room-id")
-        self.slow = bool(int(tags.get("slow", 0)))
-        self.subs_only = bool(int(tags.get("subs-only", 0)))
+        self.raw_tags: str | None = tags
 
 
 class UserStateContext:
-    __slots__ = (
-        "source", "username", "channel", "badge_info", "badges", "color",
-        "display_name", "emote_sets", "mod", "subscriber", "user_type",
-    )
+    __slots__ = ("source", "channel", "raw_tags", "_badges")
     type = ContextType.USERSTATE
 
+    badge_info = TagProperty("badge-info")
+    color = TagProperty("color", default="#FFFFFF")
+    display_name = TagProperty("display-name")
+    emote_sets = TagProperty("emote-sets")
+    mod = TagProperty("mod", int_bool, False)
+    subscriber = TagProperty("subscriber", int_bool, False)
+    user_type = TagProperty("user-type")
+
     def __init__(self, source, channel, tags):
         self.source = source
-        self.username = None
-        if "!" in source:
-            self.username = source.split("!")[0][1:]
         self.channel = channel
-        if tags is None:
-            return
-        self.badge_info = tags.get("badge-info")
-        self.badges = tags.get("badges", "").split(",")
-        self.badges = list(map(ContextBadge, [] if self.badges[0] == "" else self.badges))
-        self.color = tags.get("color", "#FFFFFF")
-        self.display_name = tags.get("display-name")
-        self.emote_sets = tags.get("emote-sets")
-        self.mod = bool(int(tags.get("mod", 0)))
-        self.subscriber = bool(int(tags.get("subscriber", 0)))
-        self.user_type = tags.get("user-type")
+        self.raw_tags: str | None = tags
+
+        self._badges = None
+
+    @property
+    def username(self) -> str | None:
+        if (i := self.source.find("!")) == -1:
+            return None
+        return self.source[1:i]
+
+    @property
+    def badges(self) -> list[ContextBadge]:
+        if self._badges is None:
+            badges = get_tag(self.raw_tags, "badges", "")
+            self._badges = [] if badges == "" else list(map(ContextBadge, badges.split(",")))
+        return self._badges
 
 
 class ContextBadge:
-    __slots__ = ("set_id", "extra", "is_sub_badge")
+    __slots__ = ("data",)
 
     def __init__(self, data):
-        self.set_id, self.extra = data.split("/")
-        self.is_sub_badge = self.set_id == "subscriber"
+        self.data: str = data
+
+    @property
+    def set_id(self) -> str:
+        return self.data[:self.data.find("/")]
+
+    @property
+    def extra(self) -> str:
+        return self.data[self.data.find("/")+1:]
+
+    @property
+    def is_sub_badge(self) -> bool:
+        return self.data.startswith("subscriber/")
 
 
 class UnknownContext:
@@ -216,3 +308,14 @@ class ServerMessageContext:
 
     def __init__(self, data):
         self.data = data
+
+
+class StreamStatusContext:
+    __slots__ = ("channel", "user_id", "is_online")
+
+    type = ContextType.STREAM_STATUS
+
+    def __init__(self, channel: str, user_id: int, is_online: bool):
+        self.channel: str = channel
+        self.user_id: int = user_id
+        self.is_online: bool = is_online
@@ -0,0 +1,118 @@
+from .context import ContextType
+
+from collections import deque
+from time import monotonic
+import asyncio
+
+
+class QueueShard:
+    __slots__ = (
+        "key", "items", "max_size", "enqueued", "dropped",
+        "max_depth", "total_latency", "max_latency", "dequeued"
+    )
+
+    def __init__(self, key: str | None, max_size: int):
+        self.key: str | None = key
+        self.items: deque[tuple[float, object]] = deque()
+        self.max_size: int = max_size
+
+        # metrics
+        self.enqueued: int = 0
+        self.dequeued: int = 0
+        self.dropped: int = 0
+        self.max_depth: int = 0
+        self.total_latency: float = 0.0
+        self.max_latency: float = 0.0
+
+    def push(self, ctx) -> bool:
+        """Returns whether the shard went from empty to non-empty"""
+        if len(self.items) >= self.max_size and ctx.type == ContextType.PRIVMSG:
+            if not self.drop_oldest_message():
+                self.dropped += 1
+                return False
+
+        was_empty = len(self.items) == 0
+        self.items.append((monotonic(), ctx))
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, len(self.items))
+        return was_empty
+
+    def drop_oldest_message(self) -> bool:
+        # chat messages are the only thing that's fine to lose, everything else
+        # (joins, state updates, setup, etc.) is allowed to go over the limit
+        for i, item in enumerate(self.items):
+            if item[1].type == ContextType.PRIVMSG:
+                del self.items[i]
+                self.dropped += 1
+                return True
+
+        return False
+
+    def pop(self) -> tuple[float, object]:
+        queued_at, ctx = self.items.popleft()
+
+        latency = monotonic() - queued_at
+        self.dequeued += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+        return queued_at, ctx
+
+    def stats(self) -> dict:
+        return {
+            "depth": len(self.items),
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "dequeued": self.dequeued,
+            "dropped": self.dropped,
+            "avg_latency": self.total_latency / self.dequeued if self.dequeued > 0 else 0.0,
+            "max_latency": self.max_latency,
+        }
+
+
+class ShardedContextQueue:
+    """
+    Keeps a bounded queue per channel (plus one for contexts without a channel)
+    and hands out contexts from them in round-robin order, so one busy channel
+    can't hold up the rest.
+    """
+
+    __slots__ = ("shards", "ready", "_not_empty")
+
+    MAX_SHARD_SIZE = 100
+
+    def __init__(self):
+        self.shards: dict[str | None, QueueShard] = {}
+        self.ready: deque[QueueShard] = deque()
+        self._not_empty: asyncio.Event = asyncio.Event()
+
+    def put_nowait(self, ctx):
+        key = getattr(ctx, "channel", None)
+        if (shard := self.shards.get(key)) is None:
+            shard = self.shards[key] = QueueShard(key, self.MAX_SHARD_SIZE)
+
+        if shard.push(ctx):
+            self.ready.append(shard)
+            self._not_empty.set()
+
+    async def put(self, ctx):
+        self.put_nowait(ctx)
+
+    async def get(self) -> tuple[float, object]:
+        """Returns the next context along with when it was queued"""
+        while len(self.ready) == 0:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+
+        shard = self.ready.popleft()
+        item = shard.pop()
+        if len(shard.items) > 0:
+            self.ready.append(shard)
+
+        return item
+
+    def qsize(self) -> int:
+        return sum(len(shard.items) for shard in self.shards.values())
+
+    def stats(self) -> dict[str | None, dict]:
+        return {key: shard.stats() for key, shard in self.shards.items()}
@@ -2,19 +2,32 @@ from __future__ import annotations
 
 from .util import matching_zip
 
-from psycopg import AsyncConnection
+from psycopg_pool import AsyncConnectionPool
 from dataclasses import dataclass
-from time import time
-from typing import TYPE_CHECKING
+from collections import OrderedDict
+from functools import lru_cache
+from bisect import bisect_left, insort
+from contextvars import ContextVar
+from time import time, monotonic
+from typing import TYPE_CHECKING, Awaitable, Callable
 import os
 import json
+import asyncio
+import logging
 
 
 if TYPE_CHECKING:
     from .commands.base import CallableCommand
 
 
-def select_fields(*objs) -> tuple[list[slice], str]:
+log = logging.getLogger(__name__)
+
+# ids of users inserted into main_user by the current transaction
+new_users_var: ContextVar[set[int]] = ContextVar("new_users")
+
+
+@lru_cache(maxsize=None)
+def select_fields(*objs) -> tuple[tuple[slice, ...], str]:
     fields = []
     indices = []
     i = 0
@@ -23,7 +36,7 @@ def select_fields(*objs) -> tuple[list[slice], str]:
         i += len(obj.Meta.FIELDS)
         fields.extend((obj.Meta.TABLE+"."+field for field in obj.Meta.FIELDS))
 
-    return indices, ",".join(fields)
+    return tuple(indices), ",".join(fields)
 
 
 @dataclass
@@ -166,37 +179,326 @@ def sqlstr(s):
     return "'"+s.replace("'", "''")+"'"
 
 
-def use_cursor(commit=False):
+def use_cursor(commit=False, pipeline=False):
+    """
+    With pipeline, statements are only sent once results are needed (or on commit),
+    so functions can execute everything, commit, and then fetch, all in one round trip.
+    """
+
     if callable(commit):
         raise RuntimeError("you forgot the parenthesis after @use_cursor")
 
     def decorator(func):
-        async def wrapper(self, *args, **kwargs):
-            conn = await self.get_connection()
-            async with conn.cursor() as cursor:
+        async def call(self, conn, cursor, args, kwargs):
+            new_users = set()
+            token = new_users_var.set(new_users)
+            try:
                 result = await func(self, *args, **kwargs, cursor=cursor)
+            finally:
+                new_users_var.reset(token)
 
-                if commit:
-                    await conn.commit()
-
-            await conn.close()
+            # does nothing if the function already committed
+            if commit:
+                await conn.commit()
+                # only once the rows are definitely there
+                self.known_users.update(new_users)
 
             return result
 
+        async def wrapper(self, *args, **kwargs):
+            start = monotonic()
+            async with self.pool.connection() as conn:
+                self.record_wait(monotonic() - start)
+
+                async with conn.cursor() as cursor:
+                    if not pipeline:
+                        return await call(self, conn, cursor, args, kwargs)
+
+                    async with conn.pipeline():
+                        return await call(self, conn, cursor, args, kwargs)
+
         return wrapper
 
     return decorator
 
 
+def sync_ledger(func):
+    """For reads that include money, so they see the changes still waiting in the ledger"""
+
+    async def wrapper(self, *args, **kwargs):
+        await self.ledger.sync()
+        return await func(self, *args, **kwargs)
+
+    return wrapper
+
+
+class UserCache:
+    """
+    LRU of user rows by id, where entries also expire after TTL seconds.
+    Rows fetched while the user's money changed are stale and aren't cached.
+    """
+
+    __slots__ = ("users", "changes", "changed", "fetches")
+
+    MAX_SIZE = 1000
+    TTL = 300
+
+    def __init__(self):
+        # user id -> (expires at, user)
+        self.users: OrderedDict[int, tuple[float, User]] = OrderedDict()
+        # number of money changes so far
+        self.changes: int = 0
+        # user id -> number of their last money change, kept while fetches are running
+        self.changed: dict[int, int] = {}
+        self.fetches: int = 0
+
+    def get(self, user_id: int) -> User | None:
+        if (item := self.users.get(user_id)) is None:
+            return
+
+        if item[0] <= monotonic():
+            del self.users[user_id]
+            return
+
+        self.users.move_to_end(user_id)
+        return item[1]
+
+    def put(self, user: User):
+        self.users[user.id] = (monotonic() + self.TTL, user)
+        self.users.move_to_end(user.id)
+        while len(self.users) > self.MAX_SIZE:
+            self.users.popitem(last=False)
+
+    def update(self, user_id: int, **values):
+        if (item := self.users.get(user_id)) is None:
+            return
+
+        for key, value in values.items():
+            setattr(item[1], key, value)
+
+    def add_money(self, user_id: int, amount: int):
+        self.changes += 1
+        if self.fetches > 0:
+            self.changed[user_id] = self.changes
+
+        if (item := self.users.get(user_id)) is not None:
+            item[1].money += amount
+
+    def start_fetch(self) -> int:
+        self.fetches += 1
+        return self.changes
+
+    def finish_fetch(self, started_at: int, user: User | None) -> bool:
+        """Caches the fetched user, unless their money changed since the fetch started"""
+        self.fetches -= 1
+        is_stale = user is not None and self.changed.get(user.id, 0) > started_at
+        if self.fetches == 0:
+            self.changed.clear()
+
+        if user is not None and not is_stale:
+            self.put(user)
+        return not is_stale
+
+
+class RankIndex:
+    """
+    Every user's balance kept in order in memory, so ranks and the leaderboard
+    are a binary search instead of sorting main_user. Loaded from the database
+    at setup and reloaded every so often in case it drifts.
+    """
+
+    __slots__ = ("users", "order", "is_loaded")
+
+    def __init__(self):
+        self.users: dict[int, User] = {}
+        # (-money, user id), so the richest come first
+        self.order: list[tuple[int, int]] = []
+        self.is_loaded: bool = False
+
+    def load(self, users: list[User]):
+        self.users = {user.id: user for user in users}
+        self.order = sorted((-user.money, user.id) for user in users)
+        self.is_loaded = True
+
+    def remove(self, user: User):
+        key = (-user.money, user.id)
+        i = bisect_left(self.order, key)
+        if i < len(self.order) and self.order[i] == key:
+            del self.order[i]
+
+    def get_or_add(self, user_id: int, username: str) -> User:
+        if (user := self.users.get(user_id)) is None:
+            # same defaults as a new main_user row
+            user = self.users[user_id] = User(user_id, username, 0, True, False)
+            insort(self.order, (0, user_id))
+        return user
+
+    def add_money(self, user_id: int, username: str, amount: int):
+        if not self.is_loaded:
+            return
+
+        user = self.get_or_add(user_id, username)
+        self.remove(user)
+        user.money += amount
+        user.username = username
+        insort(self.order, (-user.money, user_id))
+
+    def update(self, user_id: int, username: str, **values):
+        if not self.is_loaded:
+            return
+
+        user = self.get_or_add(user_id, username)
+        user.username = username
+        for key, value in values.items():
+            setattr(user, key, value)
+
+    def get_rank(self, user_id: int) -> int | None:
+        if (user := self.users.get(user_id)) is None:
+            return
+
+        # same as RANK(), users with the same balance share a rank
+        return bisect_left(self.order, (-user.money,)) + 1
+
+    def get_top(self, n: int) -> list[User]:
+        return [self.users[user_id] for _, user_id in self.order[:n]]
+
+
+class EconomyLedger:
+    """
+    Collects money changes per user and writes them all in one statement,
+    either every FLUSH_INTERVAL seconds or once FLUSH_SIZE users have changes.
+    """
+
+    __slots__ = ("db", "deltas", "lock", "full")
+
+    FLUSH_INTERVAL = 0.5
+    FLUSH_SIZE = 50
+
+    def __init__(self, db: Database):
+        self.db: Database = db
+        # user id -> (username, change in money)
+        self.deltas: dict[int, tuple[str, int]] = {}
+        self.lock: asyncio.Lock = asyncio.Lock()
+        self.full: asyncio.Event = asyncio.Event()
+
+    def add(self, user_id: int, username: str, amount: int):
+        delta = self.deltas.get(user_id)
+        self.deltas[user_id] = (username, amount if delta is None else delta[1] + amount)
+        self.db.user_cache.add_money(user_id, amount)
+        self.db.rank_index.add_money(user_id, username, amount)
+        if len(self.deltas) >= self.FLUSH_SIZE:
+            self.full.set()
+
+    async def flush(self):
+        async with self.lock:
+            if len(self.deltas) == 0:
+                return
+
+            deltas = self.deltas
+            self.deltas = {}
+            try:
+                await self.db.apply_money_deltas(deltas)
+            except Exception as exc:
+                log.exception(f"Failed to write money changes for {len(deltas)} users", exc_info=exc)
+                self.restore(deltas)
+            except BaseException:
+                # cancelled, so they'd be lost otherwise
+                self.restore(deltas)
+                raise
+
+    def restore(self, deltas: dict[int, tuple[str, int]]):
+        """Puts back changes that failed to be written, in front of anything added since"""
+        for user_id, (username, amount) in self.deltas.items():
+            delta = deltas.get(user_id)
+            deltas[user_id] = (username, amount if delta is None else delta[1] + amount)
+        self.deltas = deltas
+
+    async def sync(self):
+        # also wait for a flush that's already going
+        if len(self.deltas) > 0 or self.lock.locked():
+            await self.flush()
+
+    async def run(self, running: asyncio.Event):
+        while running.is_set():
+            try:
+                await asyncio.wait_for(self.full.wait(), self.FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+            self.full.clear()
+            await self.flush()
+
+
 class Database:
+    __slots__ = ("pool", "ledger", "user_cache", "rank_index", "known_users", "waits", "total_wait", "max_wait")
+
     CONNINFO = os.getenv("PGURL")
+    POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE") or 2)
+    POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE") or 10)
+    # connections idle for longer than this get closed, down to the min size
+    POOL_MAX_IDLE = 300
+    # prepare statements on the server the first time they're used,
+    # psycopg keeps them per connection (and evicts the least used past 100)
+    PREPARE_THRESHOLD = 0
+    # connections are replaced after this long, and idle ones are checked every POOL_CHECK_INTERVAL,
+    # rather than checking every connection when it's taken out (which costs a round trip each time)
+    POOL_MAX_LIFETIME = 1800
+    POOL_CHECK_INTERVAL = 60
+    RANK_RELOAD_INTERVAL = 600
+    USER_FETCH_ATTEMPTS = 3
 
     def __init__(self):
         if self.CONNINFO is None:
             raise RuntimeError("Failed to load the environment variable 'PGURL'")
 
-    async def get_connection(self) -> AsyncConnection:
-        return await AsyncConnection.connect(self.CONNINFO)
+        self.pool: AsyncConnectionPool = AsyncConnectionPool(
+            self.CONNINFO,
+            min_size=self.POOL_MIN_SIZE,
+            max_size=self.POOL_MAX_SIZE,
+            max_idle=self.POOL_MAX_IDLE,
+            max_lifetime=self.POOL_MAX_LIFETIME,
+            reconnect_failed=self.on_reconnect_failed,
+            kwargs={"prepare_threshold": self.PREPARE_THRESHOLD},
+            open=False
+        )
+        self.ledger: EconomyLedger = EconomyLedger(self)
+        self.user_cache: UserCache = UserCache()
+        self.rank_index: RankIndex = RankIndex()
+        # ids of users that are known to have a row in main_user
+        self.known_users: set[int] = set()
+
+        # time spent waiting for a connection from the pool
+        self.waits: int = 0
+        self.total_wait: float = 0.0
+        self.max_wait: float = 0.0
+
+    async def open(self):
+        log.info(f"Opening database pool ({self.POOL_MIN_SIZE}-{self.POOL_MAX_SIZE} connections)")
+        await self.pool.open(wait=True)
+
+    async def close(self):
+        await self.ledger.flush()
+        await self.pool.close()
+
+    async def check_pool(self):
+        """Replaces idle connections that are no longer alive"""
+        await self.pool.check()
+
+    def on_reconnect_failed(self, pool: AsyncConnectionPool):
+        log.error(f"Failed to reconnect to the database within {pool.reconnect_timeout}s")
+
+    def record_wait(self, wait: float):
+        self.waits += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def get_stats(self) -> dict:
+        return {
+            **self.pool.get_stats(),
+            "waits": self.waits,
+            "avg_wait": self.total_wait / self.waits if self.waits > 0 else 0.0,
+            "max_wait": self.max_wait,
+        }
 
     # setup
 
@@ -282,27 +584,25 @@ class Database:
 
     # pity
 
-    @use_cursor(commit=True)
+    @use_cursor(commit=True, pipeline=True)
     async def get_pity(self, user_id: int, username: str, cursor) -> tuple[int, int]:
         await self._ensure_user(cursor, user_id, username)
         await cursor.execute(
             """
-            SELECT four, five FROM main_userpity WHERE user_id = %s;
+            WITH pity AS (
+                SELECT four, five FROM main_userpity WHERE user_id = %s
+            ), created AS (
+                INSERT INTO main_userpity (four, five, user_id)
+                SELECT 0, 0, %s WHERE NOT EXISTS (SELECT 1 FROM pity)
+                RETURNING four, five
+            )
+            SELECT four, five FROM pity UNION ALL SELECT four, five FROM created;
             """,
-            (user_id,)
+            (user_id, user_id)
         )
-        pity = await cursor.fetchone()
+        await cursor.connection.commit()
 
-        if pity is None:
-            await cursor.execute(
-                """
-                INSERT INTO main_userpity (four, five, user_id) VALUES (0, 0, %s)
-                """,
-                (user_id,)
-            )
-            return 0, 0
-
-        return pity
+        return await cursor.fetchone()
 
     @use_cursor(commit=True)
     async def set_pity(self, user_id: int, four: int, five: int, cursor) -> None:
@@ -322,8 +622,7 @@ class Database:
         username: str,
         column: str,
         value,
-        default_value=None,
-        literal_value=False
+        default_value=None
     ):
         """Does not commit. Should be done by the calling function."""
 
@@ -337,15 +636,6 @@ class Database:
             columns.append(column)
             values.append("%s")
 
-        if literal_value:
-            return await cursor.execute(
-                f"""
-                INSERT INTO main_user ({','.join(columns)}) VALUES ({','.join(values)})
-                ON CONFLICT (id) DO UPDATE SET username = %s, {column} = {value}
-                """,
-                (user_id, username, default_value, username)
-            )
-
         await cursor.execute(
             f"""
             INSERT INTO main_user ({','.join(columns)}) VALUES ({','.join(values)})
@@ -353,10 +643,14 @@ class Database:
             """,
             (user_id, username, default_value, username, value)
         )
+        new_users_var.get().add(user_id)
 
     async def _ensure_user(self, cursor, user_id: int, username: str):
         """Does not commit. Should be done by the calling function."""
 
+        if user_id in self.known_users:
+            return
+
         await cursor.execute(
             """
             INSERT INTO main_user (
@@ -366,6 +660,9 @@ class Database:
             """,
             (user_id, username)
         )
+        new_users_var.get().add(user_id)
+        if self.rank_index.is_loaded:
+            self.rank_index.get_or_add(user_id, username)
 
     @use_cursor(commit=True)
     async def update_user_setting(self, user_id: int, username: str, setting: str, value, cursor) -> None:
@@ -373,9 +670,37 @@ class Database:
             raise ValueError(f"Invalid setting '{setting}'")
 
         await self._update_user(cursor, user_id, username, setting, value)
+        self.user_cache.update(user_id, username=username, **{setting: value})
+        self.rank_index.update(user_id, username, **{setting: value})
+
+    async def fetch_user(self, fetch: Callable[[], Awaitable[User | None]]) -> User | None:
+        """
+        Fetches the user and caches them. Fetched again if their money changed
+        meanwhile, since those changes may not be in the row.
+        """
+
+        for _ in range(self.USER_FETCH_ATTEMPTS):
+            started_at = self.user_cache.start_fetch()
+            user = None
+            try:
+                user = await fetch()
+            finally:
+                is_fresh = self.user_cache.finish_fetch(started_at, user)
 
+            if is_fresh:
+                break
+
+        return user
+
+    async def get_user(self, user_id: int, username: str) -> User:
+        if (user := self.user_cache.get(user_id)) is not None:
+            return user
+
+        return await self.fetch_user(lambda: self._get_user(user_id, username))
+
+    @sync_ledger
     @use_cursor(commit=True)
-    async def get_user(self, user_id: int, username: str, cursor) -> User:
+    async def _get_user(self, user_id: int, username: str, cursor) -> User:
         await self._ensure_user(cursor, user_id, username)
         await cursor.execute(
             f"""
@@ -386,24 +711,74 @@ class Database:
         user = await cursor.fetchone()
         return User(*user)
 
+    async def get_user_if_exists(self, username: str) -> User | None:
+        return await self.fetch_user(lambda: self._get_user_if_exists(username))
+
+    @sync_ledger
     @use_cursor()
-    async def get_user_if_exists(self, username: str, cursor) -> User | None:
+    async def _get_user_if_exists(self, username: str, cursor) -> User | None:
         await cursor.execute(f"SELECT {select_fields(User)[1]} FROM main_user WHERE username = %s", (username,))
         user = await cursor.fetchone()
-        return None if user is None else User(*user)
+        if user is None:
+            return
+
+        user = User(*user)
+        self.known_users.add(user.id)
+        return user
+
+    async def add_money(self, user_id: int, username: str, amount: int) -> None:
+        """Written to the database by the ledger shortly after"""
+        self.ledger.add(user_id, username, amount)
 
     @use_cursor(commit=True)
-    async def add_money(self, user_id: int, username: str, amount: int, cursor) -> None:
-        await self._update_user(cursor, user_id, username, "money", f"main_user.money + {amount}", amount, True)
+    async def apply_money_deltas(self, deltas: dict[int, tuple[str, int]], cursor) -> None:
+        await cursor.execute(
+            f"""
+            INSERT INTO main_user (id, username, money, can_receive_money, auto_remove_afk)
+            VALUES {','.join(('(%s, %s, %s, true, false)',) * len(deltas))}
+            ON CONFLICT (id) DO UPDATE SET username = EXCLUDED.username, money = main_user.money + EXCLUDED.money
+            """,
+            [value for user_id, (username, amount) in deltas.items() for value in (user_id, username, amount)],
+            # the statement changes with the number of users, so not worth preparing
+            prepare=False
+        )
+        await cursor.connection.commit()
+        self.known_users.update(deltas.keys())
 
+    @sync_ledger
     @use_cursor()
-    async def get_top_users(self, cursor):
+    async def load_rank_index(self, cursor):
+        await cursor.execute(f"SELECT {select_fields(User)[1]} FROM main_user")
+        users = [User(*user) for user in await cursor.fetchall()]
+
+        self.rank_index.load(users)
+        self.known_users.update(user.id for user in users)
+        # anything that came in while loading
+        for user_id, (username, amount) in self.ledger.deltas.items():
+            self.rank_index.add_money(user_id, username, amount)
+
+    async def get_top_users(self):
+        if self.rank_index.is_loaded:
+            return self.rank_index.get_top(5)
+
+        return await self._get_top_users()
+
+    @sync_ledger
+    @use_cursor()
+    async def _get_top_users(self, cursor):
         await cursor.execute(f"SELECT {select_fields(User)[1]} FROM main_user ORDER BY money DESC LIMIT 5")
         users = await cursor.fetchall()
         return [User(*user) for user in users]
 
-    @use_cursor(commit=True)
-    async def get_user_ranking(self, user_id: int, username: str, cursor):
+    async def get_user_ranking(self, user_id: int, username: str):
+        if (rank := self.rank_index.get_rank(user_id)) is not None:
+            return rank
+
+        return await self._get_user_ranking(user_id, username)
+
+    @sync_ledger
+    @use_cursor(commit=True, pipeline=True)
+    async def _get_user_ranking(self, user_id: int, username: str, cursor):
         await self._ensure_user(cursor, user_id, username)
         await cursor.execute(
             f"""
@@ -413,6 +788,8 @@ class Database:
             """,
             (user_id,)
         )
+        await cursor.connection.commit()
+
         rank = await cursor.fetchone()
         return rank[0]
 
@@ -483,7 +860,7 @@ class Database:
 
     # osu
 
-    @use_cursor(commit=True)
+    @use_cursor(commit=True, pipeline=True)
     async def set_osu_info(
         self,
         user_id: int,
@@ -630,18 +1007,18 @@ class Database:
     @use_cursor(commit=True)
     async def sync_commands(self, cmds: list[CallableCommand], cursor):
         await cursor.execute(f"SELECT {select_fields(Command)[1]} FROM main_command")
-        old_cmds = [Command(*command) for command in await cursor.fetchall()]
+        old_cmds = {command[1]: Command(*command) for command in await cursor.fetchall()}
+        cmd_names = set(cmd.name for cmd in cmds)
 
         for cmd in cmds:
-            old_cmd = next((old_cmd for old_cmd in old_cmds if old_cmd.name == cmd.name), None)
+            old_cmd = old_cmds.get(cmd.name)
             if old_cmd is None:
                 await self._add_command(cmd, cursor)
             else:
                 await self._update_command(old_cmd.id, cmd, cursor)
 
-        for old_cmd in old_cmds:
-            cmd = next((cmd for cmd in cmds if cmd.name == old_cmd.name), None)
-            if cmd is None:
+        for old_cmd in old_cmds.values():
+            if old_cmd.name not in cmd_names:
                 await self._remove_command(old_cmd.id, cursor)
 
     async def _add_command(self, cmd: CallableCommand, cursor):
@@ -697,7 +1074,12 @@ class Database:
     # reminders
 
     @use_cursor()
-    async def get_reminders(self, cursor) -> list[UserReminder]:
+    async def get_reminders(self, after: tuple[int, int], before: int, limit: int, cursor) -> list[UserReminder]:
+        """
+        Reminders ordered by (remind_at, id) that come after the given (remind_at, id)
+        and are due before the given time. Pass the last one back in as `after` for the next page.
+        """
+
         slices, fields = select_fields(UserReminder, User, UserChannel)
         # TODO: query is a bit inefficient data bandwidth wise
         await cursor.execute(
@@ -706,7 +1088,12 @@ class Database:
             INNER JOIN main_user ON (main_user.id = main_userreminder.user_id)
             INNER JOIN main_userchannel ON (main_userchannel.id = main_userreminder.channel_id)
             INNER JOIN main_user AS channel_user ON (main_userchannel.user_id = channel_user.id)
-            """
+            WHERE (main_userreminder.remind_at, main_userreminder.id) > (%s, %s)
+            AND main_userreminder.remind_at < %s
+            ORDER BY main_userreminder.remind_at, main_userreminder.id
+            LIMIT %s
+            """,
+            (*after, before, limit)
         )
         reminders = await cursor.fetchall()
         return [
@@ -718,7 +1105,7 @@ class Database:
             for reminder in reminders
         ]
 
-    @use_cursor(commit=True)
+    @use_cursor(commit=True, pipeline=True)
     async def create_reminder(
         self,
         user_id: int,
@@ -726,6 +1113,7 @@ class Database:
         remind_at: int,
         msg: str,
         channel_user_id: int,
+        channel_username: str,
         cursor
     ) -> UserReminder:
         await self._ensure_user(cursor, user_id, username)
@@ -739,18 +1127,19 @@ class Database:
             """,
             (channel_user_id, remind_at, msg, user_id)
         )
+        await cursor.connection.commit()
 
         return UserReminder(
             (await cursor.fetchone())[0],
             remind_at,
             msg,
             User(user_id, username, None, None, None),
-            UserChannel(None, None, None, User(channel_user_id, None, None, None, None), None)
+            UserChannel(None, None, None, User(channel_user_id, channel_username, None, None, None), None)
         )
 
     @use_cursor(commit=True)
-    async def finish_reminder(self, reminder_id: int, cursor):
-        await cursor.execute("DELETE FROM main_userreminder WHERE id = %s", (reminder_id,))
+    async def finish_reminders(self, reminder_ids: list[int], cursor):
+        await cursor.execute("DELETE FROM main_userreminder WHERE id = ANY(%s)", (reminder_ids,))
 
     # lastfm
 
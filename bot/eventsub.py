@@ -0,0 +1,418 @@
+from .context import StreamStatusContext
+from .twitch_api import TwitchAPIHelper
+
+from collections import deque
+from datetime import datetime
+from enum import Enum
+import websockets
+import asyncio
+import logging
+import json
+
+
+log = logging.getLogger(__name__)
+
+
+class EventSubMessageType(Enum):
+    WELCOME = "session_welcome"
+    KEEPALIVE = "session_keepalive"
+    NOTIFICATION = "notification"
+    RECONNECT = "session_reconnect"
+    REVOCATION = "revocation"
+
+
+class EventSubSubscriptionType(Enum):
+    AUTOMOD_MESSAGE_HOLD = "automod.message.hold"
+    AUTOMOD_MESSAGE_UPDATE = "automod.message.update"
+    AUTOMOD_SETTINGS_UPDATE = "automod.settings.update"
+    AUTOMOD_TERMS_UPDATE = "automod.terms.update"
+    CHANNEL_BITS_USE = "channel.bits.use"
+    CHANNEL_UPDATE = "channel.update"
+    CHANNEL_FOLLOW = "channel.follow"
+    CHANNEL_AD_BREAK_BEGIN = "channel.ad_break.begin"
+    CHANNEL_CHAT_CLEAR = "channel.chat.clear"
+    CHANNEL_CHAT_CLEAR_USER_MESSAGES = "channel.chat.clear_user_messages"
+    CHANNEL_CHAT_MESSAGE = "channel.chat.message"
+    CHANNEL_CHAT_MESSAGE_DELETE = "channel.chat.message_delete"
+    CHANNEL_CHAT_NOTIFICATION = "channel.chat.notification"
+    CHANNEL_CHAT_SETTINGS_UPDATE = "channel.chat_settings.update"
+    CHANNEL_CHAT_USER_MESSAGE_HOLD = "channel.chat.user_message_hold"
+    CHANNEL_CHAT_USER_MESSAGE_UPDATE = "channel.chat.user_message_update"
+    CHANNEL_SHARED_CHAT_SESSION_BEGIN = "channel.shared_chat.begin"
+    CHANNEL_SHARED_CHAT_SESSION_UPDATE = "channel.shared_chat.update"
+    CHANNEL_SHARED_CHAT_SESSION_END = "channel.shared_chat.end"
+    CHANNEL_SUBSCRIBE = "channel.subscribe"
+    CHANNEL_SUBSCRIPTION_END = "channel.subscription.end"
+    CHANNEL_SUBSCRIPTION_GIFT = "channel.subscription.gift"
+    CHANNEL_SUBSCRIPTION_MESSAGE = "channel.subscription.message"
+    CHANNEL_CHEER = "channel.cheer"
+    CHANNEL_RAID = "channel.raid"
+    CHANNEL_BAN = "channel.ban"
+    CHANNEL_UNBAN = "channel.unban"
+    CHANNEL_UNBAN_REQUEST_CREATE = "channel.unban_request.create"
+    CHANNEL_UNBAN_REQUEST_RESOLVE = "channel.unban_request.resolve"
+    CHANNEL_MODERATE = "channel.moderate"
+    CHANNEL_MODERATOR_ADD = "channel.moderator.add"
+    CHANNEL_MODERATOR_REMOVE = "channel.moderator.remove"
+    CHANNEL_GUEST_STAR_SESSION_BEGIN = "channel.guest_star_session.begin"
+    CHANNEL_GUEST_STAR_SESSION_END = "channel.guest_star_session.end"
+    CHANNEL_GUEST_STAR_SESSION_UPDATE = "channel.guest_star_session.update"
+    CHANNEL_GUEST_STAR_SETTINGS_UPDATE = "channel.guest_star_settings.update"
+    CHANNEL_POINTS_AUTO_REWARD_REDEMPTION_ADD = "channel.channel_points_automatic_reward_redemption.add"
+    CHANNEL_POINTS_CUSTOM_REWARD_ADD = "channel.channel_points_custom_reward.add"
+    CHANNEL_POINTS_CUSTOM_REWARD_UPDATE = "channel.channel_points_custom_reward.update"
+    CHANNEL_POINTS_CUSTOM_REWARD_REMOVE = "channel.channel_points_custom_reward.remove"
+    CHANNEL_POINTS_CUSTOM_REWARD_REDEMPTION_ADD = "channel.channel_points_custom_reward_redemption.add"
+    CHANNEL_POINTS_CUSTOM_REWARD_REDEMPTION_UPDATE = "channel.channel_points_custom_reward_redemption.update"
+    CHANNEL_POLL_BEGIN = "channel.poll.begin"
+    CHANNEL_POLL_PROGRESS = "channel.poll.progress"
+    CHANNEL_POLL_END = "channel.poll.end"
+    CHANNEL_PREDICTION_BEGIN = "channel.prediction.begin"
+    CHANNEL_PREDICTION_PROGRESS = "channel.prediction.progress"
+    CHANNEL_PREDICTION_LOCK = "channel.prediction.lock"
+    CHANNEL_PREDICTION_END = "channel.prediction.end"
+    CHANNEL_SUSPICIOUS_USER_MESSAGE = "channel.suspicious_user.message"
+    CHANNEL_SUSPICIOUS_USER_UPDATE = "channel.suspicious_user.update"
+    CHANNEL_VIP_ADD = "channel.vip.add"
+    CHANNEL_VIP_REMOVE = "channel.vip.remove"
+    CHANNEL_WARNING_ACK = "channel.warning.acknowledge"
+    CHANNEL_WARNING_SEND = "channel.warning.send"
+    CHARITY_DONATION = "channel.charity_campaign.donate"
+    CHARITY_CAMPAIGN_START = "channel.charity_campaign.start"
+    CHARITY_CAMPAIGN_PROGRESS = "channel.charity_campaign.progress"
+    CHARITY_CAMPAIGN_STOP = "channel.charity_campaign.stop"
+    CONDUIT_SHARD_DISABLED = "conduit.shard.disabled"
+    DROP_ENTITLEMENT_GRANT = "drop.entitlement.grant"
+    EXTENSION_BITS_TRANSACTION_CREATE = "extension.bits_transaction.create"
+    GOAL_BEGIN = "channel.goal.begin"
+    GOAL_PROGRESS = "channel.goal.progress"
+    GOAL_END = "channel.goal.end"
+    HYPE_TRAIN_BEGIN = "channel.hype_train.begin"
+    HYPE_TRAIN_PROGRESS = "channel.hype_train.progress"
+    HYPE_TRAIN_END = "channel.hype_train.end"
+    SHIELD_MODE_BEGIN = "channel.shield_mode.begin"
+    SHIELD_MODE_END = "channel.shield_mode.end"
+    SHOUTOUT_CREATE = "channel.shoutout.create"
+    SHOUTOUT_RECEIVED = "channel.shoutout.received"
+    STREAM_ONLINE = "stream.online"
+    STREAM_OFFLINE = "stream.offline"
+    USER_AUTH_GRANT = "user.authorization.grant"
+    USER_AUTH_REVOKE = "user.authorization.revoke"
+    USER_UPDATE = "user.update"
+    WHISPER_RECEIVED = "user.whisper.message"
+
+
+class SessionStatus(Enum):
+    CONNECTED = "connected"
+    RECONNECTING = "reconnecting"
+
+
+class SubscriptionStatus(Enum):
+    ENABLED = "enabled"
+    AUTH_REVOKED = "authorization_revoked"
+    USER_REMOVED = "user_removed"
+    VERSION_REMOVED = "version_removed"
+
+
+class EventSubMetadata:
+    __slots__ = ("id", "type", "timestamp")
+
+    def __init__(self, data: dict):
+        metadata = data["metadata"]
+        self.id: str = metadata["message_id"]
+        self.type: str = metadata["message_type"]
+        self.timestamp: datetime = datetime.fromisoformat(metadata["message_timestamp"])
+
+
+class EventSubMetadataExt(EventSubMetadata):
+    __slots__ = ("subscription_type", "subscription_version")
+
+    def __init__(self, data: dict):
+        super().__init__(data)
+
+        metadata = data["metadata"]
+        self.subscription_type: EventSubSubscriptionType = EventSubSubscriptionType(metadata["subscription_type"])
+        self.subscription_version: str = metadata["subscription_version"]
+
+
+class EventSubSession:
+    __slots__ = ("id", "status", "connected_at", "keepalive_timeout_seconds", "reconnect_url")
+
+    def __init__(self, data: dict):
+        self.id: str = data["id"]
+        self.status: SessionStatus = SessionStatus(data["status"])
+        self.connected_at: datetime = datetime.fromisoformat(data["connected_at"])
+        self.keepalive_timeout_seconds: int = data["keepalive_timeout_seconds"]
+        self.reconnect_url: str = data["reconnect_url"]
+
+
+class EventSubSubscription:
+    __slots__ = ("id", "status", "type", "version", "cost", "condition", "transport", "created_at", "event")
+
+    def __init__(self, data: dict):
+        self.id: str = data["id"]
+        self.status: SubscriptionStatus = SubscriptionStatus(data["status"])
+        self.type: EventSubSubscriptionType = EventSubSubscriptionType(data["type"])
+        self.version: str = data["version"]
+        self.cost: int = data["cost"]
+        self.condition: dict = data["condition"]
+        self.transport: dict = data["transport"]
+        self.created_at: datetime = datetime.fromisoformat(data["created_at"])
+
+
+# Websocket messages
+
+class EventSubWelcomeMessage:
+    __slots__ = ("metadata", "session")
+
+    def __init__(self, data: dict):
+        self.metadata: EventSubMetadata = EventSubMetadata(data)
+        self.session: EventSubSession = EventSubSession(data["payload"]["session"])
+
+
+class EventSubKeepaliveMessage:
+    __slots__ = ("metadata",)
+
+    def __init__(self, data: dict):
+        self.metadata: EventSubMetadata = EventSubMetadata(data)
+
+
+class EventSubNotificationMessage:
+    __slots__ = ("metadata", "subscription", "event")
+
+    def __init__(self, data: dict):
+        self.metadata: EventSubMetadataExt = EventSubMetadataExt(data)
+        payload = data["payload"]
+        self.subscription: EventSubSubscription = EventSubSubscription(payload["subscription"])
+        self.event: dict = payload["event"]
+
+
+class EventSubReconnectMessage:
+    __slots__ = ("metadata", "session")
+
+    def __init__(self, data: dict):
+        self.metadata: EventSubMetadata = EventSubMetadata(data)
+        self.session: EventSubSession = EventSubSession(data["payload"]["session"])
+
+
+class EventSubRevocationMessage:
+    __slots__ = ("metadata", "subscription")
+
+    def __init__(self, data: dict):
+        self.metadata: EventSubMetadataExt = EventSubMetadataExt(data)
+        self.subscription: EventSubSubscription = EventSubSubscription(data["payload"]["subscription"])
+
+
+def parse_eventsub_msg(data):
+    return {
+        EventSubMessageType.WELCOME: EventSubWelcomeMessage,
+        EventSubMessageType.KEEPALIVE: EventSubKeepaliveMessage,
+        EventSubMessageType.RECONNECT: EventSubReconnectMessage,
+        EventSubMessageType.NOTIFICATION: EventSubNotificationMessage,
+        EventSubMessageType.REVOCATION: EventSubRevocationMessage
+    }[EventSubMessageType(data["metadata"]["message_type"])](data)
+
+
+class EventSubClient:
+    """
+    Keeps a websocket session with twitch's eventsub and subscribes to stream.online
+    and stream.offline for every broadcaster it's told about. The events are pushed
+    into the context queue as StreamStatusContext. Broadcasters it couldn't
+    subscribe to are listed by get_unsubscribed, so they can be polled instead.
+    """
+
+    __slots__ = (
+        "manager", "running", "twitch_client", "token", "url", "broadcasters", "subscriptions",
+        "session_id", "keepalive_timeout", "seen_messages", "on_subscribed"
+    )
+
+    URL = "wss://eventsub.wss.twitch.tv/ws"
+    SUBSCRIPTIONS_URL = "https://api.twitch.tv/helix/eventsub/subscriptions"
+    STREAM_EVENTS = (EventSubSubscriptionType.STREAM_ONLINE, EventSubSubscriptionType.STREAM_OFFLINE)
+    RECONNECT_WAIT = 5
+    WELCOME_TIMEOUT = 10
+    # on top of the keepalive timeout twitch gives, before the connection is considered dead
+    KEEPALIVE_GRACE = 5
+    # twitch can send a message more than once
+    SEEN_MESSAGES = 100
+
+    def __init__(
+        self,
+        manager,
+        running: asyncio.Event,
+        twitch_client: TwitchAPIHelper,
+        token: str,
+        url: str = URL
+    ):
+        self.manager = manager
+        self.running: asyncio.Event = running
+        self.twitch_client: TwitchAPIHelper = twitch_client
+        # websocket subscriptions have to be made with a user token
+        self.token: str = token.removeprefix("oauth:")
+        self.url: str = url
+
+        # broadcaster id -> channel name
+        self.broadcasters: dict[int, str] = {}
+        # broadcaster id -> subscription ids, which only last as long as the session
+        self.subscriptions: dict[int, list[str]] = {}
+        self.session_id: str | None = None
+        self.keepalive_timeout: float = 10
+        self.seen_messages: deque[str] = deque(maxlen=self.SEEN_MESSAGES)
+        # called after subscribing on a new session, since events could have been missed
+        self.on_subscribed = None
+
+    async def run(self):
+        ws = None
+        try:
+            while self.running.is_set():
+                try:
+                    if ws is None:
+                        ws = await self.connect(self.url)
+                    ws = await self.receive(ws)
+                except asyncio.TimeoutError:
+                    log.warning("No message from eventsub within the keepalive timeout")
+                except websockets.ConnectionClosed as exc:
+                    log.warning(f"Eventsub connection closed: {exc}")
+                except Exception as exc:
+                    log.exception("Exception on eventsub connection", exc_info=exc)
+                else:
+                    continue
+
+                if ws is not None:
+                    await ws.close()
+                    ws = None
+
+                self.session_id = None
+                self.subscriptions.clear()
+                await asyncio.sleep(self.RECONNECT_WAIT)
+        finally:
+            # also when cancelled
+            if ws is not None:
+                await ws.close()
+
+    async def connect(self, url: str):
+        ws = await websockets.connect(url)
+        try:
+            msg = parse_eventsub_msg(json.loads(await asyncio.wait_for(ws.recv(), self.WELCOME_TIMEOUT)))
+            if not isinstance(msg, EventSubWelcomeMessage):
+                raise RuntimeError(f"Expected a welcome message from eventsub, got {msg.metadata.type}")
+        except Exception:
+            await ws.close()
+            raise
+
+        # a reconnect keeps the same session, along with its subscriptions
+        is_new_session = msg.session.id != self.session_id
+        self.session_id = msg.session.id
+        self.keepalive_timeout = msg.session.keepalive_timeout_seconds
+        log.info(f"Connected to eventsub (session {self.session_id})")
+
+        if is_new_session:
+            self.subscriptions.clear()
+            await self.subscribe_all()
+
+        return ws
+
+    async def receive(self, ws):
+        """Returns the websocket to continue with, which changes when twitch asks to reconnect"""
+        while self.running.is_set():
+            data = await asyncio.wait_for(ws.recv(), self.keepalive_timeout + self.KEEPALIVE_GRACE)
+            msg = parse_eventsub_msg(json.loads(data))
+
+            if msg.metadata.id in self.seen_messages:
+                continue
+            self.seen_messages.append(msg.metadata.id)
+
+            if isinstance(msg, EventSubNotificationMessage):
+                await self.on_notification(msg)
+            elif isinstance(msg, EventSubReconnectMessage):
+                log.info("Eventsub requested a reconnect")
+                # the old connection keeps working until the new one is welcomed
+                new_ws = await self.connect(msg.session.reconnect_url)
+                await ws.close()
+                return new_ws
+            elif isinstance(msg, EventSubRevocationMessage):
+                self.on_revocation(msg)
+
+        return ws
+
+    async def on_notification(self, msg: EventSubNotificationMessage):
+        if msg.subscription.type not in self.STREAM_EVENTS:
+            return
+
+        await self.manager.queue_ctx(StreamStatusContext(
+            msg.event["broadcaster_user_login"],
+            int(msg.event["broadcaster_user_id"]),
+            msg.subscription.type == EventSubSubscriptionType.STREAM_ONLINE
+        ))
+
+    def on_revocation(self, msg: EventSubRevocationMessage):
+        log.warning(f"Eventsub subscription {msg.subscription.id} was revoked ({msg.subscription.status.value})")
+        for subscription_ids in self.subscriptions.values():
+            if msg.subscription.id in subscription_ids:
+                subscription_ids.remove(msg.subscription.id)
+
+    # subscriptions
+
+    def get_unsubscribed(self) -> set[int]:
+        """
+        Broadcasters missing some of their subscriptions, because subscribing failed,
+        they were revoked, or there's no session. Their events won't come through eventsub.
+        """
+        return {
+            broadcaster_id
+            for broadcaster_id in self.broadcasters
+            if len(self.subscriptions.get(broadcaster_id, ())) < len(self.STREAM_EVENTS)
+        }
+
+    def get_headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}", "Client-Id": self.twitch_client.client_id}
+
+    async def subscribe(self, broadcaster_id: int, channel: str):
+        self.broadcasters[broadcaster_id] = channel
+        if self.session_id is not None and broadcaster_id not in self.subscriptions:
+            await self.create_subscriptions(broadcaster_id)
+
+    async def unsubscribe(self, broadcaster_id: int):
+        self.broadcasters.pop(broadcaster_id, None)
+        for subscription_id in self.subscriptions.pop(broadcaster_id, []):
+            await self.twitch_client.make_request(
+                "delete",
+                self.SUBSCRIPTIONS_URL,
+                False,
+                params={"id": subscription_id},
+                headers=self.get_headers()
+            )
+
+    async def subscribe_all(self):
+        await asyncio.gather(*(
+            self.create_subscriptions(broadcaster_id)
+            for broadcaster_id in list(self.broadcasters.keys())
+            if broadcaster_id not in self.subscriptions
+        ))
+
+        if self.on_subscribed is not None:
+            await self.on_subscribed()
+
+    async def create_subscriptions(self, broadcaster_id: int):
+        # marked first so it's not subscribed to twice while waiting
+        subscription_ids = self.subscriptions[broadcaster_id] = []
+        session_id = self.session_id
+
+        for sub_type in self.STREAM_EVENTS:
+            data = await self.twitch_client.make_request(
+                "post",
+                self.SUBSCRIPTIONS_URL,
+                False,
+                json={
+                    "type": sub_type.value,
+                    "version": "1",
+                    "condition": {"broadcaster_user_id": str(broadcaster_id)},
+                    "transport": {"method": "websocket", "session_id": session_id}
+                },
+                headers=self.get_headers()
+            )
+            if data is None:
+                log.warning(f"Failed to subscribe to {sub_type.value} for {self.broadcasters.get(broadcaster_id)}")
+                continue
+
+            subscription_ids.append(data["data"][0]["id"])
@@ -0,0 +1,94 @@
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, ClientResponse, client_exceptions
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+import asyncio
+import logging
+import random
+
+
+log = logging.getLogger(__name__)
+
+
+class HTTPClient:
+    """
+    One aiohttp session shared by everything in the bot, so connections
+    (and dns lookups) are reused instead of made again for every request.
+    Requests that fail on the connection or with a temporary status are
+    retried with backoff.
+    """
+
+    __slots__ = ("_session",)
+
+    LIMIT = 100
+    LIMIT_PER_HOST = 10
+    KEEPALIVE_TIMEOUT = 30
+    DNS_CACHE_TTL = 300
+    TIMEOUT = 20
+    CONNECT_TIMEOUT = 5
+    MAX_RETRIES = 2
+    RETRY_BACKOFF = 0.5
+    MAX_RETRY_WAIT = 10
+    RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+    # only retried by default if sending them twice is harmless
+    IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+
+    def __init__(self):
+        self._session: ClientSession | None = None
+
+    @property
+    def session(self) -> ClientSession:
+        # created lazily since it has to be made inside the running loop
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                connector=TCPConnector(
+                    limit=self.LIMIT,
+                    limit_per_host=self.LIMIT_PER_HOST,
+                    keepalive_timeout=self.KEEPALIVE_TIMEOUT,
+                    ttl_dns_cache=self.DNS_CACHE_TTL
+                ),
+                timeout=ClientTimeout(total=self.TIMEOUT, connect=self.CONNECT_TIMEOUT)
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    def get_retry_wait(self, attempt: int, resp: ClientResponse | None = None) -> float:
+        if resp is not None and (retry_after := resp.headers.get("Retry-After", "")).isdigit():
+            return min(int(retry_after), self.MAX_RETRY_WAIT)
+
+        wait = self.RETRY_BACKOFF * (2 ** attempt)
+        return min(wait + random.uniform(0, wait), self.MAX_RETRY_WAIT)
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, retries: int | None = None, **kwargs) -> AsyncIterator[ClientResponse]:
+        if retries is None:
+            retries = self.MAX_RETRIES if method.upper() in self.IDEMPOTENT_METHODS else 0
+
+        attempt = 0
+        while True:
+            try:
+                resp = await self.session.request(method, url, **kwargs)
+            except (client_exceptions.ClientConnectionError, asyncio.TimeoutError) as exc:
+                if attempt >= retries:
+                    raise
+                wait = self.get_retry_wait(attempt)
+                log.warning(f"{method.upper()} {url} failed ({exc!r}), retrying in {wait:.1f}s")
+            else:
+                if resp.status not in self.RETRY_STATUSES or attempt >= retries:
+                    break
+                wait = self.get_retry_wait(attempt, resp)
+                resp.release()
+                log.warning(f"{method.upper()} {url} returned {resp.status}, retrying in {wait:.1f}s")
+
+            attempt += 1
+            await asyncio.sleep(wait)
+
+        try:
+            yield resp
+        finally:
+            resp.release()
+
+    def get(self, url: str, **kwargs):
+        return self.request("get", url, **kwargs)
@@ -0,0 +1,243 @@
+from .context import get_contexts, ContextType
+
+from collections import deque
+from time import monotonic
+import websockets
+import asyncio
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+class IRCConnection:
+    __slots__ = ("pool", "index", "ws", "channels", "is_ready")
+
+    def __init__(self, pool: "IRCPool", index: int):
+        self.pool: IRCPool = pool
+        self.index: int = index
+        self.ws = None
+        self.channels: set[str] = set()
+        self.is_ready: bool = False
+
+    async def run(self):
+        while self.pool.running.is_set():
+            try:
+                async with websockets.connect(self.pool.uri) as ws:
+                    self.ws = ws
+                    await self.login()
+                    await self.receive()
+            except websockets.ConnectionClosed as exc:
+                log.warning(f"IRC connection {self.index} closed: {exc}")
+            except Exception as exc:
+                log.exception(f"Exception on IRC connection {self.index}", exc_info=exc)
+            finally:
+                self.ws = None
+                self.pool.on_connection_lost(self)
+
+            if self.pool.running.is_set():
+                await asyncio.sleep(self.pool.RECONNECT_WAIT)
+
+    async def login(self):
+        log.info(f"Connecting to irc server as {self.pool.username} (connection {self.index})")
+        await self.ws.send(f"PASS {self.pool.oauth}")
+        await self.ws.send(f"NICK {self.pool.username}")
+        if len(self.pool.caps) > 0:
+            await self.ws.send(f"CAP REQ :{' '.join(self.pool.caps)}")
+
+    async def receive(self):
+        while self.pool.running.is_set():
+            data = await self.ws.recv()
+
+            if data.startswith("PING"):
+                await self.ws.send("PONG :tmi.twitch.tv")
+                continue
+
+            for ctx in get_contexts(data):
+                if ctx.type == ContextType.CONNECTED:
+                    self.is_ready = True
+                    if not self.pool.on_connection_ready(self):
+                        continue
+                elif ctx.type == ContextType.RECONNECT:
+                    # twitch wants this connection gone, so let the pool move the channels elsewhere
+                    await self.ws.close()
+
+                await self.pool.queue_ctx(ctx)
+
+    async def send(self, data: str) -> bool:
+        if self.ws is None:
+            return False
+
+        try:
+            await self.ws.send(data)
+            return True
+        except websockets.ConnectionClosed:
+            return False
+
+
+class IRCPool:
+    """
+    Spreads the joined channels across several irc connections by hash.
+    Everything received is fed into the same context queue, so the bots
+    still see a single stream.
+    """
+
+    __slots__ = (
+        "manager", "running", "uri", "username", "oauth", "caps", "connections", "homes",
+        "join_queue", "join_event", "join_times"
+    )
+
+    RECONNECT_WAIT = 5
+    # how often the idle join loop checks if the bot is stopping
+    IDLE_WAIT = 1
+    # twitch allows 20 join attempts per 10 seconds
+    JOIN_LIMIT = 20
+    JOIN_PERIOD = 10
+
+    def __init__(self, manager, running: asyncio.Event, uri: str, username: str, oauth: str, size: int):
+        self.manager = manager
+        self.running: asyncio.Event = running
+        self.uri: str = uri
+        self.username: str = username
+        self.oauth: str = oauth
+        self.caps: list[str] = []
+
+        self.connections: list[IRCConnection] = [IRCConnection(self, i) for i in range(size)]
+        # channel -> connection it's joined (or being joined) on, None if waiting for one
+        self.homes: dict[str, IRCConnection | None] = {}
+
+        self.join_queue: deque[str] = deque()
+        self.join_event: asyncio.Event = asyncio.Event()
+        self.join_times: deque[float] = deque()
+
+    async def run(self):
+        connections = asyncio.gather(*(conn.run() for conn in self.connections))
+        try:
+            await self.run_join_loop()
+            # otherwise they'd wait for the next message to notice
+            await self.close()
+            await connections
+        finally:
+            connections.cancel()
+
+    async def close(self):
+        for conn in self.connections:
+            if conn.ws is not None:
+                await conn.ws.close()
+
+    async def queue_ctx(self, ctx):
+        await self.manager.queue_ctx(ctx)
+
+    # connection events
+
+    def on_connection_ready(self, conn: IRCConnection) -> bool:
+        """Returns whether this is the first connection to be ready"""
+        for channel, home in self.homes.items():
+            if home is None:
+                self.queue_join(channel)
+
+        return sum(1 for other in self.connections if other.is_ready) == 1
+
+    def on_connection_lost(self, conn: IRCConnection):
+        conn.is_ready = False
+        channels = conn.channels
+        conn.channels = set()
+
+        if len(channels) > 0:
+            log.info(f"Moving {len(channels)} channels off of IRC connection {conn.index}")
+        for channel in channels:
+            if self.homes.get(channel) is conn:
+                self.homes[channel] = None
+                self.queue_join(channel)
+
+    # channels
+
+    def get_home(self, channel: str) -> IRCConnection | None:
+        # rendezvous hashing so losing a connection only moves the channels that were on it
+        return max(
+            (conn for conn in self.connections if conn.is_ready),
+            key=lambda conn: hash((channel, conn.index)),
+            default=None
+        )
+
+    def queue_join(self, channel: str):
+        self.join_queue.append(channel)
+        self.join_event.set()
+
+    def join(self, channel: str):
+        channel = channel.lower()
+        if channel in self.homes:
+            return
+
+        self.homes[channel] = None
+        self.queue_join(channel)
+
+    async def part(self, channel: str):
+        channel = channel.lower()
+        conn = self.homes.pop(channel, None)
+        if conn is None:
+            return
+
+        conn.channels.discard(channel)
+        await conn.send(f"PART #{channel}")
+
+    async def wait_for_join_slot(self):
+        while len(self.join_times) >= self.JOIN_LIMIT:
+            wait = self.join_times[0] + self.JOIN_PERIOD - monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.join_times.popleft()
+
+    def is_join_pending(self, channel: str) -> bool:
+        # not parted or already joined since being queued
+        return channel in self.homes and self.homes[channel] is None
+
+    async def run_join_loop(self):
+        while self.running.is_set():
+            if len(self.join_queue) == 0:
+                self.join_event.clear()
+                try:
+                    await asyncio.wait_for(self.join_event.wait(), self.IDLE_WAIT)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            channel = self.join_queue.popleft()
+            if not self.is_join_pending(channel) or self.get_home(channel) is None:
+                # a channel without a connection is picked back up when one becomes ready
+                continue
+
+            await self.wait_for_join_slot()
+
+            # it could've been parted, or lost its connection, while waiting
+            if not self.is_join_pending(channel) or (conn := self.get_home(channel)) is None:
+                continue
+
+            log.info(f"Joining #{channel} on IRC connection {conn.index}")
+            if not await conn.send(f"JOIN #{channel}"):
+                self.queue_join(channel)
+                continue
+
+            self.join_times.append(monotonic())
+            self.homes[channel] = conn
+            conn.channels.add(channel)
+
+    # sending
+
+    async def register_cap(self, *caps):
+        caps = [f"twitch.tv/{cap}" for cap in caps if f"twitch.tv/{cap}" not in self.caps]
+        if len(caps) == 0:
+            return
+
+        self.caps.extend(caps)
+        for conn in self.connections:
+            await conn.send(f"CAP REQ :{' '.join(caps)}")
+
+    async def send(self, channel: str, data: str) -> bool:
+        conn = self.homes.get(channel.lower())
+        if conn is None:
+            conn = next((conn for conn in self.connections if conn.is_ready), None)
+            if conn is None:
+                return False
+
+        return await conn.send(data)
@@ -0,0 +1,192 @@
+from contextvars import ContextVar
+from bisect import bisect_left
+from time import monotonic
+from typing import Awaitable, Callable
+import asyncio
+import logging
+import os
+
+
+log = logging.getLogger(__name__)
+
+# when the context being handled was queued, inherited by tasks the handler starts (i.e. commands)
+queued_at_var: ContextVar[float | None] = ContextVar("queued_at", default=None)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count", "max")
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        # last one is +Inf
+        self.counts: list[int] = [0] * (len(self.BUCKETS) + 1)
+        self.sum: float = 0.0
+        self.count: int = 0
+        self.max: float = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    @property
+    def avg(self) -> float:
+        return self.sum / self.count if self.count > 0 else 0.0
+
+    def cumulative(self):
+        total = 0
+        for le, count in zip((*map(str, self.BUCKETS), "+Inf"), self.counts):
+            total += count
+            yield le, total
+
+
+class HandlerStats:
+    __slots__ = ("calls", "errors", "in_flight", "latency", "duration")
+
+    def __init__(self):
+        self.calls: int = 0
+        self.errors: int = 0
+        self.in_flight: int = 0
+        # from the context being queued to the handler starting
+        self.latency: Histogram = Histogram()
+        self.duration: Histogram = Histogram()
+
+
+def format_labels(labels: dict) -> str:
+    if len(labels) == 0:
+        return ""
+
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    return "{" + ",".join(f"{key}=\"{escape(value)}\"" for key, value in labels.items()) + "}"
+
+
+class Metrics:
+    """
+    Timings, error counts and in-flight counts for every context handler and
+    command, rendered in the prometheus text format along with any gauges
+    passed in.
+    """
+
+    __slots__ = ("handlers", "commands")
+
+    def __init__(self):
+        # (context type, handler) -> stats
+        self.handlers: dict[tuple[str, str], HandlerStats] = {}
+        self.commands: dict[str, HandlerStats] = {}
+
+    async def track(self, stats: HandlerStats, coro: Awaitable, queued_at: float | None):
+        start = monotonic()
+        if queued_at is not None:
+            stats.latency.observe(start - queued_at)
+
+        stats.calls += 1
+        stats.in_flight += 1
+        try:
+            return await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.in_flight -= 1
+            stats.duration.observe(monotonic() - start)
+
+    async def run_handler(self, ctx_type: str, handler: Callable, ctx, queued_at: float):
+        key = (ctx_type, handler.__qualname__)
+        if (stats := self.handlers.get(key)) is None:
+            stats = self.handlers[key] = HandlerStats()
+
+        queued_at_var.set(queued_at)
+        try:
+            await self.track(stats, handler(ctx), queued_at)
+        except Exception as exc:
+            log.exception(f"Exception in {handler.__qualname__}", exc_info=exc)
+
+    async def run_command(self, name: str, coro: Awaitable):
+        if (stats := self.commands.get(name)) is None:
+            stats = self.commands[name] = HandlerStats()
+
+        return await self.track(stats, coro, queued_at_var.get())
+
+    def get_slowest(self, n: int) -> list[tuple[str, HandlerStats]]:
+        """Handlers and commands that took the most time on average"""
+        items = [(handler, stats) for (_, handler), stats in self.handlers.items()]
+        items.extend((f"!{name}", stats) for name, stats in self.commands.items())
+        return sorted(items, key=lambda item: item[1].duration.avg, reverse=True)[:n]
+
+    def render(self, gauges: list[tuple[str, str, dict, float]]) -> str:
+        """gauges are (name, type, labels, value)"""
+        metrics: dict[str, tuple[str, list[str]]] = {}
+
+        def add(name, metric_type, labels, value):
+            if name not in metrics:
+                metrics[name] = (metric_type, [])
+            metrics[name][1].append(f"{name}{format_labels(labels)} {value}")
+
+        def add_stats(prefix, labels, stats):
+            add(f"{prefix}_calls_total", "counter", labels, stats.calls)
+            add(f"{prefix}_errors_total", "counter", labels, stats.errors)
+            add(f"{prefix}_in_flight", "gauge", labels, stats.in_flight)
+            for suffix, histogram in (("latency_seconds", stats.latency), ("duration_seconds", stats.duration)):
+                name = f"{prefix}_{suffix}"
+                samples = metrics.setdefault(name, ("histogram", []))[1]
+                for le, count in histogram.cumulative():
+                    samples.append(f"{name}_bucket{format_labels({**labels, 'le': le})} {count}")
+                samples.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                samples.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+        for (ctx_type, handler), stats in self.handlers.items():
+            add_stats("bot_handler", {"ctx_type": ctx_type, "handler": handler}, stats)
+        for name, stats in self.commands.items():
+            add_stats("bot_command", {"command": name}, stats)
+        for gauge in gauges:
+            add(*gauge)
+
+        lines = []
+        for name, (metric_type, samples) in metrics.items():
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves the metrics on localhost for prometheus to scrape"""
+
+    __slots__ = ("render",)
+
+    PORT = os.getenv("METRICS_PORT")
+
+    def __init__(self, render: Callable[[], str]):
+        self.render: Callable[[], str] = render
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # whatever was requested, the response is the same
+            while await reader.readline() not in (b"\r\n", b"\n", b""):
+                pass
+
+            body = self.render().encode("utf-8")
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+                b"Connection: close\r\n\r\n" + body
+            )
+            await writer.drain()
+        except Exception as exc:
+            log.exception("Exception while serving metrics", exc_info=exc)
+        finally:
+            writer.close()
+
+    async def run(self):
+        server = await asyncio.start_server(self.handle, host="localhost", port=self.PORT)
+
+        log.info(f"Serving metrics on port {self.PORT}")
+
+        async with server:
+            await server.serve_forever()
@@ -0,0 +1,234 @@
+from .util import split_message, MAX_MESSAGE_LENGTH
+
+from collections import deque
+from enum import IntEnum
+from time import monotonic
+from typing import Callable, Awaitable
+import asyncio
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+class MessagePriority(IntEnum):
+    REPLY = 0
+    PERIODIC = 1
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated_at")
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity: int = capacity
+        self.rate: float = capacity / period
+        self.tokens: float = capacity
+        self.updated_at: float = monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def get_wait(self, now: float) -> float:
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self.refill(now)
+        self.tokens -= 1
+
+
+class OutboundMessage:
+    __slots__ = ("channel", "messages", "priority", "index", "futures", "ready_at", "sending", "coalesce")
+
+    def __init__(
+        self,
+        channel: str,
+        messages: list[str],
+        priority: MessagePriority,
+        future: asyncio.Future,
+        ready_at: float,
+        coalesce: bool
+    ):
+        self.channel: str = channel
+        self.messages: list[str] = messages
+        self.priority: MessagePriority = priority
+        self.index: int = 0
+        # more than one if other messages were merged into this one
+        self.futures: list[asyncio.Future] = [future]
+        self.ready_at: float = ready_at
+        # a part is on its way out, so the text can't change anymore
+        self.sending: bool = False
+        self.coalesce: bool = coalesce
+
+    def can_merge(self, message: str) -> bool:
+        return (
+            self.coalesce and
+            not self.sending and
+            self.index == 0 and
+            len(self.messages) == 1 and
+            len(self.messages[0]) + len(MessageScheduler.COALESCE_SEPARATOR) + len(message) <= MAX_MESSAGE_LENGTH
+        )
+
+
+class MessageScheduler:
+    """
+    Sends chat messages while staying under twitch's rate limits: a global limit
+    (higher in channels the bot moderates) and a minimum interval per channel.
+    Replies are sent before periodic messages.
+
+    With coalescing on, short messages queued for the same channel within a
+    small window are merged into one line, so they only use up one send.
+    Messages whose sent text matters to the caller (e.g. to look up replies
+    to it) can be queued with coalesce=False.
+    """
+
+    __slots__ = (
+        "send", "is_mod", "last_message", "queues", "global_bucket", "mod_global_bucket",
+        "next_send_at", "has_messages", "coalesce"
+    )
+
+    # twitch allows 20 messages per 30 seconds, or 100 in channels where the bot is a moderator
+    GLOBAL_LIMIT = 20
+    MOD_GLOBAL_LIMIT = 100
+    GLOBAL_PERIOD = 30
+    CHANNEL_INTERVAL = 1.5
+    MOD_CHANNEL_INTERVAL = 0.3
+    RETRY_WAIT = 1
+    COALESCE_WINDOW = 0.25
+    COALESCE_SEPARATOR = " | "
+
+    def __init__(
+        self,
+        send: Callable[[str, str], Awaitable[bool]],
+        is_mod: Callable[[str], bool],
+        last_message: dict[str, str],
+        coalesce: bool = False
+    ):
+        self.send = send
+        self.is_mod = is_mod
+        self.last_message: dict[str, str] = last_message
+        self.coalesce: bool = coalesce
+
+        self.queues: tuple[deque[OutboundMessage], ...] = tuple(deque() for _ in MessagePriority)
+        self.global_bucket: TokenBucket = TokenBucket(self.GLOBAL_LIMIT, self.GLOBAL_PERIOD)
+        self.mod_global_bucket: TokenBucket = TokenBucket(self.MOD_GLOBAL_LIMIT, self.GLOBAL_PERIOD)
+        self.next_send_at: dict[str, float] = {}
+        self.has_messages: asyncio.Event = asyncio.Event()
+
+    def queue(self, channel: str, message: str, priority: MessagePriority, coalesce: bool = True) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        messages = split_message(message)
+        if len(messages) == 0:
+            future.set_result(messages)
+            return future
+
+        coalesce = coalesce and self.coalesce
+        ready_at = monotonic()
+        if coalesce and len(messages) == 1:
+            pending = self.get_pending(channel, priority)
+            if pending is not None and pending.can_merge(messages[0]):
+                pending.messages[0] += self.COALESCE_SEPARATOR + messages[0]
+                pending.futures.append(future)
+                return future
+
+            # give other messages a moment to be merged into this one
+            ready_at += self.COALESCE_WINDOW
+
+        self.queues[priority].append(OutboundMessage(channel, messages, priority, future, ready_at, coalesce))
+        self.has_messages.set()
+        return future
+
+    def get_pending(self, channel: str, priority: MessagePriority) -> OutboundMessage | None:
+        """Last message queued for the channel, so merging doesn't change the order"""
+        for msg in reversed(self.queues[priority]):
+            if msg.channel == channel:
+                return msg
+
+    def get_wait(self, channel: str, now: float) -> float:
+        wait = max(self.next_send_at.get(channel, now) - now, self.mod_global_bucket.get_wait(now))
+        if not self.is_mod(channel):
+            wait = max(wait, self.global_bucket.get_wait(now))
+        return wait
+
+    def next_message(self, now: float) -> tuple[OutboundMessage | None, float | None]:
+        wait = None
+        for queue in self.queues:
+            blocked = set()
+            for msg in queue:
+                # keep messages in order within a channel
+                if msg.channel in blocked:
+                    continue
+
+                msg_wait = max(self.get_wait(msg.channel, now), msg.ready_at - now)
+                if msg_wait <= 0:
+                    return msg, None
+
+                blocked.add(msg.channel)
+                wait = msg_wait if wait is None else min(wait, msg_wait)
+
+        return None, wait
+
+    async def run(self, running: asyncio.Event):
+        while running.is_set():
+            msg, wait = self.next_message(monotonic())
+            if msg is None:
+                self.has_messages.clear()
+                try:
+                    await asyncio.wait_for(self.has_messages.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self.send_next(msg)
+            except Exception as exc:
+                log.exception(f"Failed to send message in #{msg.channel}", exc_info=exc)
+                # dropped, so a message that keeps failing doesn't hold up the rest
+                self.remove(msg)
+                self.next_send_at[msg.channel] = monotonic() + self.RETRY_WAIT
+                for future in msg.futures:
+                    if not future.done():
+                        future.set_exception(exc)
+
+    def remove(self, msg: OutboundMessage):
+        queue = self.queues[msg.priority]
+        if queue[0] is msg:
+            queue.popleft()
+        else:
+            queue.remove(msg)
+
+    async def send_next(self, msg: OutboundMessage):
+        channel = msg.channel
+        text = msg.messages[msg.index]
+        is_mod = self.is_mod(channel)
+
+        log.info(f"Sending message in #{channel}: {text}")
+        msg.sending = True
+        try:
+            # twitch drops identical messages sent back to back, so make it different
+            sent = await self.send(
+                channel,
+                f"PRIVMSG #{channel} :/me " + text + (" \U000e0000" if self.last_message.get(channel) == text else "")
+            )
+        finally:
+            msg.sending = False
+
+        now = monotonic()
+        if not sent:
+            self.next_send_at[channel] = now + self.RETRY_WAIT
+            return
+
+        self.last_message[channel] = text
+        self.next_send_at[channel] = now + (self.MOD_CHANNEL_INTERVAL if is_mod else self.CHANNEL_INTERVAL)
+        self.mod_global_bucket.take(now)
+        if not is_mod:
+            self.global_bucket.take(now)
+
+        msg.index += 1
+        if msg.index == len(msg.messages):
+            self.remove(msg)
+
+            for future in msg.futures:
+                if not future.done():
+                    future.set_result(msg.messages)
@@ -4,6 +4,7 @@ import logging
 import json
 
 from .context import ServerMessageContext
+from .context_queue import ShardedContextQueue
 
 
 log = logging.getLogger(__name__)
@@ -12,15 +13,15 @@ log = logging.getLogger(__name__)
 class MessageProtocol(asyncio.Protocol):
     __slots__ = ("loop", "ctx_queue", "transport")
 
-    def __init__(self, loop: asyncio.AbstractEventLoop, ctx_queue: asyncio.Queue):
+    def __init__(self, loop: asyncio.AbstractEventLoop, ctx_queue: ShardedContextQueue):
         self.loop: asyncio.AbstractEventLoop = loop
-        self.ctx_queue: asyncio.Queue = ctx_queue
+        self.ctx_queue: ShardedContextQueue = ctx_queue
 
     def connection_made(self, transport):
         self.transport = transport
 
     def data_received(self, data: bytes):
-        self.loop.create_task(self.ctx_queue.put(ServerMessageContext(json.loads(data.decode("utf-8")))))
+        self.ctx_queue.put_nowait(ServerMessageContext(json.loads(data.decode("utf-8"))))
 
         self.transport.close()
 
@@ -30,9 +31,9 @@ class MessageServer:
 
     PORT = os.getenv("SERVER_PORT")
 
-    def __init__(self, loop: asyncio.AbstractEventLoop, ctx_queue: asyncio.Queue):
+    def __init__(self, loop: asyncio.AbstractEventLoop, ctx_queue: ShardedContextQueue):
         self.loop: asyncio.AbstractEventLoop = loop
-        self.ctx_queue = ctx_queue
+        self.ctx_queue: ShardedContextQueue = ctx_queue
 
     async def run(self):
         server = await self.loop.create_server(
@@ -1,16 +1,19 @@
 import asyncio
 import logging
 from time import monotonic
-from aiohttp import ClientSession, client_exceptions
+from aiohttp import client_exceptions
+
+from .http_client import HTTPClient
 
 
 log = logging.getLogger(__name__)
 
 
 class TwitchAPIHelper:
-    def __init__(self, client_id: str, client_secret: str):
+    def __init__(self, client_id: str, client_secret: str, http: HTTPClient):
         self.client_id: str = client_id
         self.client_secret: str = client_secret
+        self.http: HTTPClient = http
         self._token: str | None = None
         self._expires_at: int = 0
         self._lock: asyncio.Lock = asyncio.Lock()
@@ -66,15 +69,14 @@ class TwitchAPIHelper:
         headers.update(kwargs.pop("headers", {}))
 
         try:
-            async with ClientSession() as session:
-                async with session.request(method, url, headers=headers, **kwargs) as resp:
-                    data = await resp.json()
-                    if "error" in data:
-                        log.error(f"Request to {url} failed: {data['error']}")
-                        return return_on_error
-
-                    return data
-        except client_exceptions.ClientError:
+            async with self.http.request(method, url, headers=headers, **kwargs) as resp:
+                data = await resp.json()
+                if "error" in data:
+                    log.error(f"Request to {url} failed: {data['error']}")
+                    return return_on_error
+
+                return data
+        except (client_exceptions.ClientError, asyncio.TimeoutError):
             return return_on_error
 
     async def get(self, endpoint, return_on_error=None, **kwargs):
@@ -2,23 +2,248 @@ import asyncio
 from datetime import datetime
 import pytz
 import logging
+import sys
+import threading
+import traceback
 from typing import Iterable, Callable, TypeVar
-from time import time
+from time import time, monotonic, sleep
 
 
 log = logging.getLogger(__name__)
 
+MAX_MESSAGE_LENGTH = 495
 
-async def wait_and_call(wait, callback, *args, **kwargs):
-    await asyncio.sleep(wait)
-    await callback(*args, **kwargs)
+
+class Timer:
+    """Handle returned by TimerWheel.call_later, cancelling works like it would on a task"""
+
+    __slots__ = ("wheel", "deadline", "callback", "args", "kwargs", "slot", "task", "_cancelled")
+
+    def __init__(self, wheel: "TimerWheel", deadline: float, callback: Callable, args: tuple, kwargs: dict):
+        self.wheel: TimerWheel = wheel
+        self.deadline: float = deadline
+        self.callback: Callable = callback
+        self.args: tuple = args
+        self.kwargs: dict = kwargs
+        self.slot: dict | None = None
+        self.task: asyncio.Task | None = None
+        self._cancelled: bool = False
+
+    def cancel(self) -> bool:
+        if self.slot is not None:
+            del self.slot[self]
+            self.slot = None
+            self.wheel.count -= 1
+            self._cancelled = True
+            return True
+
+        if self.task is not None and not self.task.done():
+            self._cancelled = True
+            return self.task.cancel()
+
+        return False
+
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def done(self) -> bool:
+        return self._cancelled or (self.task is not None and self.task.done())
+
+
+class TimerWheel:
+    """
+    Hierarchical timer wheel: scheduling and cancelling are O(1) and a single
+    coroutine sleeps until the next tick that has something in it.
+    Each level has SLOTS slots covering SLOTS times the span of the level below,
+    and a level's slot is moved down a level when the one below wraps around.
+    """
+
+    __slots__ = ("loop", "levels", "tick", "count", "wakeup")
+
+    TICK = 0.1
+    SLOTS = 64
+    # 64^4 ticks is a bit over 19 days, anything later is re-inserted as it gets closer
+    LEVELS = 4
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop: asyncio.AbstractEventLoop = loop
+        self.levels: list[list[dict[Timer, None]]] = [
+            [{} for _ in range(self.SLOTS)]
+            for _ in range(self.LEVELS)
+        ]
+        # next tick to be processed
+        self.tick: int = self.get_tick(monotonic())
+        self.count: int = 0
+        self.wakeup: asyncio.Event = asyncio.Event()
+
+    @classmethod
+    def get_tick(cls, t: float) -> int:
+        return int(t / cls.TICK)
+
+    def call_later(self, wait: float, callback: Callable, *args, **kwargs) -> Timer:
+        """callback is a coroutine function"""
+        if self.count == 0:
+            # nothing was being processed, so skip the ticks that went by
+            self.tick = max(self.tick, self.get_tick(monotonic()))
+
+        timer = Timer(self, monotonic() + wait, callback, args, kwargs)
+        self.insert(timer)
+        self.wakeup.set()
+        return timer
+
+    def insert(self, timer: Timer):
+        expires = max(-int(-timer.deadline // self.TICK), self.tick)
+        delta = expires - self.tick
+
+        span = self.SLOTS
+        for level in self.levels[:-1]:
+            if delta < span:
+                break
+            span *= self.SLOTS
+        else:
+            level = self.levels[-1]
+            expires = min(expires, self.tick + span - 1)
+
+        slot = level[(expires * self.SLOTS // span) % self.SLOTS]
+        slot[timer] = None
+        timer.slot = slot
+        self.count += 1
+
+    def process_tick(self):
+        tick = self.tick
+
+        # move down the slots of any level that just came around, from the top
+        level_i = 0
+        span = 1
+        while level_i < self.LEVELS - 1 and (tick // span) % self.SLOTS == 0:
+            level_i += 1
+            span *= self.SLOTS
+        for i in range(level_i, 0, -1):
+            span //= self.SLOTS
+            self.cascade(self.levels[i][(tick // (span * self.SLOTS)) % self.SLOTS])
+
+        slot = self.levels[0][tick % self.SLOTS]
+        self.tick += 1
+        if len(slot) == 0:
+            return
+
+        timers = list(slot)
+        slot.clear()
+        for timer in timers:
+            timer.slot = None
+            self.count -= 1
+            if self.get_tick(timer.deadline) >= self.tick:
+                # was too far out for the wheel
+                self.insert(timer)
+                continue
+
+            timer.task = self.loop.create_task(timer.callback(*timer.args, **timer.kwargs))
+            timer.task.add_done_callback(self.on_timer_done)
+
+    def cascade(self, slot: dict[Timer, None]):
+        timers = list(slot)
+        slot.clear()
+        for timer in timers:
+            timer.slot = None
+            self.count -= 1
+            self.insert(timer)
+
+    @staticmethod
+    def on_timer_done(task: asyncio.Task):
+        if not task.cancelled() and (exc := task.exception()) is not None:
+            log.exception("Exception in timer callback", exc_info=exc)
+
+    def get_next_tick(self) -> int:
+        # the higher levels come down at the start of a block, before its level 0 slots are looked at
+        level = self.levels[0]
+        if self.tick % self.SLOTS == 0 and self.count > sum(map(len, level)):
+            return self.tick
+
+        # next tick with something in it, or the one where the next level comes down
+        end = self.tick - self.tick % self.SLOTS + self.SLOTS
+        for tick in range(self.tick, end):
+            if len(level[tick % self.SLOTS]) > 0:
+                return tick
+        return end
+
+    async def run(self, running: asyncio.Event):
+        while running.is_set():
+            now_tick = self.get_tick(monotonic())
+            while self.count > 0 and self.tick <= now_tick:
+                self.process_tick()
+
+            self.wakeup.clear()
+            if self.count == 0:
+                await self.wakeup.wait()
+                continue
+
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), max(self.get_next_tick() * self.TICK - monotonic(), 0))
+            except asyncio.TimeoutError:
+                pass
+
+
+class LoopWatchdog:
+    """
+    Logs whenever the event loop is blocked for longer than the threshold.
+    The loop bumps a heartbeat, and a thread that checks it logs the stack
+    of whatever is running on the loop if the heartbeat goes stale.
+    """
+
+    __slots__ = ("threshold", "heartbeat", "loop_thread", "thread", "stalls", "max_lag")
+
+    INTERVAL = 0.1
+
+    def __init__(self, threshold: float):
+        self.threshold: float = threshold
+        self.heartbeat: float = monotonic()
+        self.loop_thread: int | None = None
+        self.thread: threading.Thread | None = None
+
+        self.stalls: int = 0
+        self.max_lag: float = 0.0
+
+    async def run(self, running: asyncio.Event):
+        self.loop_thread = threading.get_ident()
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.watch, args=(running,), name="loop-watchdog", daemon=True)
+            self.thread.start()
+
+        while running.is_set():
+            self.heartbeat = expected = monotonic() + self.INTERVAL
+            await asyncio.sleep(self.INTERVAL)
+
+            lag = monotonic() - expected
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.threshold:
+                self.stalls += 1
+                log.warning(f"Event loop was blocked for {lag:.3f}s")
+
+    def watch(self, running: asyncio.Event):
+        reported = None
+        while running.is_set():
+            sleep(self.threshold)
+
+            heartbeat = self.heartbeat
+            if heartbeat == reported or monotonic() - heartbeat < self.threshold:
+                continue
+
+            reported = heartbeat
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is not None:
+                log.warning(
+                    f"Event loop blocked for over {self.threshold}s in:\n{''.join(traceback.format_stack(frame))}"
+                )
+
+    def stats(self) -> dict:
+        return {"stalls": self.stalls, "max_lag": self.max_lag}
 
 
 def split_message(message):
     messages = []
     while len(message) > 0:
-        messages.append(message[:495].strip())
-        message = message[495:]
+        messages.append(message[:MAX_MESSAGE_LENGTH].strip())
+        message = message[MAX_MESSAGE_LENGTH:]
     return messages
 
 
@@ -5,6 +5,7 @@ if __name__ == "__main__":
 
     from bot import BotManager
     import sys
+    import signal
     import asyncio
     import logging
 
@@ -18,4 +19,27 @@ if __name__ == "__main__":
 
     loop = asyncio.new_event_loop()
     manager = BotManager(loop)
-    loop.run_until_complete(manager.run())
+    run_task = loop.create_task(manager.run())
+
+    def shutdown():
+        manager.stop()
+        run_task.cancel()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, shutdown)
+        except NotImplementedError:
+            # windows, where ctrl+c raises KeyboardInterrupt instead
+            pass
+
+    try:
+        while not run_task.done():
+            try:
+                loop.run_until_complete(run_task)
+            except KeyboardInterrupt:
+                shutdown()
+            except asyncio.CancelledError:
+                pass
+    finally:
+        # writes out what's still waiting in the ledger
+        loop.run_until_complete(manager.close())
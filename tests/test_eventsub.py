@@ -0,0 +1,249 @@
+import os
+
+# bot.bot needs these to be importable
+os.environ.setdefault("IRC_USERNAME", "test")
+os.environ.setdefault("IRC_OAUTH", "oauth:test")
+
+from bot.context import StreamStatusContext
+from bot.eventsub import EventSubClient
+
+import unittest
+import websockets
+import asyncio
+import itertools
+import json
+
+
+TIMESTAMP = "2024-01-01T00:00:00.000000000Z"
+
+
+class FastEventSubClient(EventSubClient):
+    __slots__ = ()
+
+    RECONNECT_WAIT = 0.1
+    KEEPALIVE_GRACE = 0.2
+
+
+class FakeTwitchClient:
+    client_id = "client id"
+
+    def __init__(self, fail: bool = False):
+        self.fail: bool = fail
+        self.ids = itertools.count()
+        # (method, subscription type, session id)
+        self.requests: list[tuple[str, str | None, str | None]] = []
+
+    async def make_request(self, method, url, auth, **kwargs):
+        data = kwargs.get("json", {})
+        self.requests.append((method, data.get("type"), data.get("transport", {}).get("session_id")))
+        if self.fail:
+            return
+        return {"data": [{"id": f"subscription {next(self.ids)}"}]}
+
+
+class FakeManager:
+    def __init__(self):
+        self.ctxs: list[StreamStatusContext] = []
+
+    async def queue_ctx(self, ctx):
+        self.ctxs.append(ctx)
+
+
+class EventSubServer:
+    """Local eventsub websocket server, where each connection is handled by the next given handler"""
+
+    def __init__(self, *handlers):
+        self.handlers = list(handlers)
+        self.ids = itertools.count()
+        self.connections: int = 0
+        self.server = None
+
+    @property
+    def url(self) -> str:
+        return f"ws://localhost:{self.server.sockets[0].getsockname()[1]}/ws"
+
+    async def start(self):
+        self.server = await websockets.serve(self.handle, "localhost", 0)
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, ws, path=None):
+        handler = self.handlers[min(self.connections, len(self.handlers) - 1)]
+        self.connections += 1
+        await handler(self, ws)
+        # keep the connection open until the client is done with it
+        await ws.wait_closed()
+
+    def metadata(self, message_type: str, subscription_type: str | None = None) -> dict:
+        metadata = {
+            "message_id": f"message {next(self.ids)}",
+            "message_type": message_type,
+            "message_timestamp": TIMESTAMP
+        }
+        if subscription_type is not None:
+            metadata["subscription_type"] = subscription_type
+            metadata["subscription_version"] = "1"
+        return metadata
+
+    def session(self, message_type: str, session_id: str, keepalive: int = 10, reconnect_url: str | None = None):
+        return json.dumps({
+            "metadata": self.metadata(message_type),
+            "payload": {"session": {
+                "id": session_id,
+                "status": "connected" if reconnect_url is None else "reconnecting",
+                "connected_at": TIMESTAMP,
+                "keepalive_timeout_seconds": keepalive,
+                "reconnect_url": reconnect_url
+            }}
+        })
+
+    def welcome(self, session_id: str, keepalive: int = 10) -> str:
+        return self.session("session_welcome", session_id, keepalive)
+
+    def reconnect(self, session_id: str) -> str:
+        return self.session("session_reconnect", session_id, reconnect_url=self.url)
+
+    def notification(self, subscription_type: str, channel: str, user_id: int) -> str:
+        return json.dumps({
+            "metadata": self.metadata("notification", subscription_type),
+            "payload": {
+                "subscription": {
+                    "id": "subscription",
+                    "status": "enabled",
+                    "type": subscription_type,
+                    "version": "1",
+                    "cost": 0,
+                    "condition": {"broadcaster_user_id": str(user_id)},
+                    "transport": {"method": "websocket"},
+                    "created_at": TIMESTAMP
+                },
+                "event": {"broadcaster_user_login": channel, "broadcaster_user_id": str(user_id)}
+            }
+        })
+
+
+async def wait_until(condition, timeout: float = 5):
+    async def wait():
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(wait(), timeout)
+
+
+class EventSubClientTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.running = asyncio.Event()
+        self.running.set()
+        self.manager = FakeManager()
+        self.twitch_client = FakeTwitchClient()
+        self.subscribed_sessions: list[str] = []
+
+    async def start(self, *handlers) -> tuple[EventSubServer, EventSubClient]:
+        server = EventSubServer(*handlers)
+        await server.start()
+        self.addAsyncCleanup(server.close)
+
+        client = FastEventSubClient(self.manager, self.running, self.twitch_client, "oauth:token", server.url)
+        await client.subscribe(1, "streamer")
+
+        async def on_subscribed():
+            self.subscribed_sessions.append(client.session_id)
+
+        client.on_subscribed = on_subscribed
+        task = asyncio.create_task(client.run())
+
+        async def stop():
+            self.running.clear()
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        # cleanups run last first, so the client stops before the server
+        self.addAsyncCleanup(stop)
+        return server, client
+
+    def get_subscribe_requests(self) -> list[tuple[str, str]]:
+        return [(sub_type, session_id) for method, sub_type, session_id in self.twitch_client.requests if method == "post"]
+
+    async def test_welcome_subscribes(self):
+        async def handler(server, ws):
+            await ws.send(server.welcome("session"))
+
+        _, client = await self.start(handler)
+        await wait_until(lambda: len(self.subscribed_sessions) > 0)
+
+        self.assertEqual(self.get_subscribe_requests(), [("stream.online", "session"), ("stream.offline", "session")])
+        self.assertEqual(client.token, "token")
+        self.assertEqual(client.get_unsubscribed(), set())
+
+    async def test_notifications_are_queued_once(self):
+        async def handler(server, ws):
+            await ws.send(server.welcome("session"))
+            online = server.notification("stream.online", "streamer", 1)
+            # twitch may send the same message again
+            await ws.send(online)
+            await ws.send(online)
+            await ws.send(server.notification("stream.offline", "streamer", 1))
+
+        await self.start(handler)
+        await wait_until(lambda: len(self.manager.ctxs) >= 2)
+        await asyncio.sleep(0.1)
+
+        self.assertEqual(
+            [(ctx.channel, ctx.user_id, ctx.is_online) for ctx in self.manager.ctxs],
+            [("streamer", 1, True), ("streamer", 1, False)]
+        )
+
+    async def test_session_reconnect_keeps_subscriptions(self):
+        async def first(server, ws):
+            await ws.send(server.welcome("session"))
+            await wait_until(lambda: len(self.subscribed_sessions) > 0)
+            await ws.send(server.reconnect("session"))
+
+        async def second(server, ws):
+            await ws.send(server.welcome("session"))
+            await ws.send(server.notification("stream.online", "streamer", 1))
+
+        server, client = await self.start(first, second)
+        await wait_until(lambda: len(self.manager.ctxs) > 0)
+
+        self.assertEqual(server.connections, 2)
+        self.assertEqual(self.subscribed_sessions, ["session"])
+        self.assertEqual(len(self.get_subscribe_requests()), 2)
+        self.assertEqual(client.get_unsubscribed(), set())
+
+    async def test_keepalive_timeout_reconnects(self):
+        async def first(server, ws):
+            # then nothing, not even keepalives
+            await ws.send(server.welcome("first session", keepalive=0))
+
+        async def second(server, ws):
+            await ws.send(server.welcome("second session"))
+
+        await self.start(first, second)
+        await wait_until(lambda: len(self.subscribed_sessions) > 1)
+
+        self.assertEqual(self.subscribed_sessions, ["first session", "second session"])
+        self.assertEqual(
+            [session_id for _, session_id in self.get_subscribe_requests()],
+            ["first session", "first session", "second session", "second session"]
+        )
+
+    async def test_failed_subscriptions_are_unsubscribed(self):
+        self.twitch_client.fail = True
+
+        async def handler(server, ws):
+            await ws.send(server.welcome("session"))
+
+        _, client = await self.start(handler)
+        await wait_until(lambda: len(self.subscribed_sessions) > 0)
+
+        self.assertEqual(client.get_unsubscribed(), {1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+
+# bot.bot needs these to be importable
+os.environ.setdefault("IRC_USERNAME", "test")
+os.environ.setdefault("IRC_OAUTH", "oauth:test")
+
+from bot.util import TimerWheel
+
+from time import monotonic
+import unittest
+import asyncio
+
+
+class FastTimerWheel(TimerWheel):
+    __slots__ = ()
+
+    TICK = 0.02
+
+
+class TimerWheelTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.running = asyncio.Event()
+        self.running.set()
+        self.wheel = FastTimerWheel(asyncio.get_running_loop())
+        # timer name -> how late it fired
+        self.late: dict[str, float] = {}
+        self.task = asyncio.create_task(self.wheel.run(self.running))
+
+    async def asyncTearDown(self):
+        self.running.clear()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    def call_at_tick(self, name: str, tick: int):
+        # halfway into the tick before, so it's due on that tick
+        deadline = (tick - 0.5) * FastTimerWheel.TICK
+
+        async def callback():
+            self.late[name] = monotonic() - deadline
+
+        self.wheel.call_later(deadline - monotonic(), callback)
+
+    async def wait_for_timers(self, n: int):
+        async def wait():
+            while len(self.late) < n:
+                await asyncio.sleep(FastTimerWheel.TICK / 4)
+
+        await asyncio.wait_for(wait(), 5)
+
+    def assert_on_time(self):
+        for name, late in self.late.items():
+            # within a tick, plus a bit for the loop to get to it
+            self.assertLess(late, FastTimerWheel.TICK + 0.01, name)
+
+    async def test_far_timer_fires_on_time(self):
+        self.call_at_tick("far", self.wheel.tick + FastTimerWheel.SLOTS + 10)
+        await self.wait_for_timers(1)
+        self.assert_on_time()
+
+    async def test_timer_after_block_end_fires_on_time(self):
+        slots = FastTimerWheel.SLOTS
+        # one in the last slot of a block, then one in the next block that started out a level up
+        last_slot = self.wheel.tick + slots
+        last_slot += slots - 1 - last_slot % slots
+        self.call_at_tick("last slot", last_slot)
+        self.call_at_tick("next block", last_slot + 6)
+
+        await self.wait_for_timers(2)
+        self.assert_on_time()
+
+
+if __name__ == "__main__":
+    unittest.main()